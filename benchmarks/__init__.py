@@ -0,0 +1,5 @@
+"""
+Benchmarks for the sampling loop and its tools, run as modules, e.g.
+
+    python -m computer_use_demo.benchmarks.loop_benchmark
+"""
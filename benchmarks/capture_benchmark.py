@@ -0,0 +1,125 @@
+"""
+Benchmark of Linux screenshot capture: the in-process XCB backend of the
+ComputerTool against its gnome-screenshot/scrot and ImageMagick fallback.
+
+    python -m computer_use_demo.benchmarks.capture_benchmark --xvfb
+
+With --xvfb a virtual display is started for the run (Xvfb must be on PATH),
+otherwise the display of $DISPLAY_NUM, or $DISPLAY, is captured.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+from ..tools.base import ToolResult
+from ..tools.computer import ComputerTool
+
+XVFB_DISPLAY_NUM = 99
+XVFB_SIZE = (1280, 800)
+
+
+@dataclass
+class CaptureResult:
+    backend: str
+    ms_mean: float
+    ms_min: float
+    kb: float
+
+
+@contextmanager
+def xvfb(display_num: int, size: tuple[int, int]) -> Iterator[None]:
+    """Run Xvfb on `:display_num` for the duration of the block."""
+    if not shutil.which("Xvfb"):
+        raise SystemExit("Xvfb is not installed")
+    process = subprocess.Popen(
+        ["Xvfb", f":{display_num}", "-screen", "0", f"{size[0]}x{size[1]}x24"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        # the socket appears once the server accepts connections
+        socket = f"/tmp/.X11-unix/X{display_num}"
+        deadline = time.monotonic() + 5
+        while not os.path.exists(socket):
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise SystemExit(f"Xvfb :{display_num} did not start")
+            time.sleep(0.05)
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def measure(
+    backend: str, capture: Callable[[], Awaitable[ToolResult]], repeat: int
+) -> CaptureResult:
+    timings = []
+    result = ToolResult()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await capture()
+        timings.append((time.perf_counter() - start) * 1000)
+    return CaptureResult(
+        backend=backend,
+        ms_mean=statistics.fmean(timings),
+        ms_min=min(timings),
+        # of the base64 string sent to the API
+        kb=len(result.base64_image or "") / 1024,
+    )
+
+
+async def run(repeat: int) -> list[CaptureResult]:
+    tool = ComputerTool()
+    results = []
+    for backend, capture in (
+        ("xcb", tool._capture_in_process),
+        ("subprocess", tool._capture_with_subprocess),
+    ):
+        try:
+            result = await measure(backend, capture, repeat)
+        except Exception as e:
+            print(f"{backend:>10}: unavailable ({type(e).__name__}: {e})")
+            continue
+        results.append(result)
+        print(
+            f"{backend:>10}: {result.ms_mean:8.1f} ms mean, "
+            f"{result.ms_min:8.1f} ms min | {result.kb:8.1f} KiB"
+        )
+    return results
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--xvfb", action="store_true", help="capture a virtual display started here"
+    )
+    parser.add_argument("--json", metavar="PATH", help="also write the results here")
+    args = parser.parse_args(argv)
+
+    if args.xvfb:
+        os.environ.update(
+            DISPLAY_NUM=str(XVFB_DISPLAY_NUM),
+            WIDTH=str(XVFB_SIZE[0]),
+            HEIGHT=str(XVFB_SIZE[1]),
+        )
+        with xvfb(XVFB_DISPLAY_NUM, XVFB_SIZE):
+            results = asyncio.run(run(args.repeat))
+    else:
+        results = asyncio.run(run(args.repeat))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark of Linux input latency: the in-process XTest driver of the
+ComputerTool against an xdotool process per action.
+
+    python -m computer_use_demo.benchmarks.input_benchmark --xvfb
+
+With --xvfb a virtual display is started for the run (Xvfb must be on PATH),
+otherwise the display of $DISPLAY_NUM, or $DISPLAY, gets the input.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import shutil
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+
+from ..tools.run import run
+from ..tools.xinput import XInputDriver
+from .capture_benchmark import XVFB_DISPLAY_NUM, XVFB_SIZE, xvfb
+
+TEXT = "The quick brown fox jumps over the lazy dog, 0123456789!"
+
+
+@dataclass
+class InputResult:
+    action: str
+    driver: str
+    ms_mean: float
+    ms_min: float
+
+
+async def measure(
+    action: str, driver: str, send: Callable[[], Awaitable[object]], repeat: int
+) -> InputResult:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await send()
+        timings.append((time.perf_counter() - start) * 1000)
+    return InputResult(
+        action=action,
+        driver=driver,
+        ms_mean=statistics.fmean(timings),
+        ms_min=min(timings),
+    )
+
+
+async def xdotool(args: str):
+    returncode, _, stderr = await run(f"xdotool {args}")
+    if returncode:
+        raise RuntimeError(stderr)
+
+
+async def run_actions(repeat: int) -> list[InputResult]:
+    display = os.getenv("DISPLAY_NUM")
+    if display is not None:
+        os.environ["DISPLAY"] = f":{display}"
+    drivers: dict[str, dict[str, Callable[[], Awaitable[object]]]] = {}
+    try:
+        xinput = XInputDriver(os.getenv("DISPLAY"))
+    except OSError as e:
+        print(f"   xinput: unavailable ({e})")
+    else:
+        drivers["xinput"] = {
+            "mouse_move": lambda: xinput.move(100, 100),
+            "left_click": lambda: xinput.click(1),
+            "key": lambda: xinput.key("shift+Home"),
+            "type": lambda: xinput.type(TEXT),
+            "cursor_position": xinput.cursor_position,
+        }
+    if shutil.which("xdotool"):
+        drivers["xdotool"] = {
+            "mouse_move": lambda: xdotool("mousemove --sync 100 100"),
+            "left_click": lambda: xdotool("click 1"),
+            "key": lambda: xdotool("key -- shift+Home"),
+            "type": lambda: xdotool(f"type --delay 0 -- {shlex.quote(TEXT)}"),
+            "cursor_position": lambda: xdotool("getmouselocation --shell"),
+        }
+    else:
+        print("  xdotool: unavailable (not installed)")
+
+    results = []
+    for driver, actions in drivers.items():
+        for action, send in actions.items():
+            result = await measure(action, driver, send, repeat)
+            results.append(result)
+            print(
+                f"{action:>16} {driver:>8}: {result.ms_mean:8.2f} ms mean, "
+                f"{result.ms_min:8.2f} ms min"
+            )
+    if "xinput" in drivers:
+        xinput.close()
+    return results
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--xvfb", action="store_true", help="send input to a virtual display"
+    )
+    parser.add_argument("--json", metavar="PATH", help="also write the results here")
+    args = parser.parse_args(argv)
+
+    if args.xvfb:
+        os.environ["DISPLAY_NUM"] = str(XVFB_DISPLAY_NUM)
+        with xvfb(XVFB_DISPLAY_NUM, XVFB_SIZE):
+            results = asyncio.run(run_actions(args.repeat))
+    else:
+        results = asyncio.run(run_actions(args.repeat))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
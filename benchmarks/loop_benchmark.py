@@ -0,0 +1,427 @@
+"""
+End-to-end benchmark of the overhead `sampling_loop` adds to every turn.
+
+A local stand-in for the Messages API scripts a tool_use response for every
+turn, and fake tools answer with canned screenshots and text after a set
+latency. This leaves only the loop's own work between a response and the next
+request: parsing, callbacks, history pruning and caching, building the tool
+results and serializing the ever-growing request.
+
+    python -m computer_use_demo.benchmarks.loop_benchmark --turns 10 100 500
+"""
+
+import argparse
+import asyncio
+import base64
+import gc
+import io
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from anthropic.types.beta import BetaMessageParam, BetaToolUnionParam
+from PIL import Image
+
+from ..clients import APIProvider, close_clients
+from ..images import ImageStore
+from ..loop import sampling_loop
+from ..metrics import SessionMetrics
+from ..tools import ToolCollection, ToolResult
+from ..tools.base import BaseAnthropicTool
+
+SCREEN_SIZE = (1024, 768)
+# side of the noisy, incompressible square that keeps screenshots realistically big
+NOISE_SIZE = 256
+SCREENSHOT_VARIANTS = 8
+
+
+class MockMessagesServer:
+    """
+    A minimal HTTP/1.1 server on localhost answering Messages API requests.
+
+    Every response but the last asks for a screenshot, and every other one also
+    for a bash command, so the tools run concurrently. Arrival (body fully read)
+    and departure (response written) times of the requests are recorded.
+    """
+
+    def __init__(self, turns: int, *, api_latency: float = 0.0):
+        self.turns = turns
+        self.api_latency = api_latency
+        self.arrivals: list[float] = []
+        self.departures: list[float] = []
+        self.body_bytes: list[int] = []
+        self._server: asyncio.Server | None = None
+
+    @property
+    def base_url(self) -> str:
+        assert self._server is not None
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def __aenter__(self) -> "MockMessagesServer":
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        assert self._server is not None
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while request_line := await reader.readline():
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.arrivals.append(time.perf_counter())
+                content_type, payload = self._respond(request_line, body)
+                if self.api_latency:
+                    await asyncio.sleep(self.api_latency)
+                writer.write(
+                    (
+                        "HTTP/1.1 200 OK\r\n"
+                        f"content-type: {content_type}\r\n"
+                        f"content-length: {len(payload)}\r\n\r\n"
+                    ).encode()
+                    + payload
+                )
+                await writer.drain()
+                self.departures.append(time.perf_counter())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, request_line: bytes, body: bytes) -> tuple[str, bytes]:
+        if not request_line.startswith(b"POST"):
+            return "application/json", b"{}"
+        self.body_bytes.append(len(body))
+        request = json.loads(body)
+        turn = sum(
+            1 for message in request["messages"] if message["role"] == "assistant"
+        )
+        content: list[dict[str, Any]] = [{"type": "text", "text": f"Step {turn}."}]
+        if turn + 1 < self.turns:
+            content.append(_tool_use(turn, 0, "computer", {"action": "screenshot"}))
+            if turn % 2:
+                content.append(
+                    _tool_use(turn, 1, "bash", {"command": f"ls -la /tmp/{turn}"})
+                )
+        message = {
+            "id": f"msg_{turn:04d}",
+            "type": "message",
+            "role": "assistant",
+            "model": request["model"],
+            "content": content,
+            "stop_reason": "tool_use" if len(content) > 1 else "end_turn",
+            "stop_sequence": None,
+            # roughly what the API would count, for the rate limiter and metrics
+            "usage": {"input_tokens": len(body) // 4, "output_tokens": 50},
+        }
+        if not request.get("stream"):
+            return "application/json", json.dumps(message).encode()
+        return "text/event-stream", _stream_events(message)
+
+
+def _tool_use(
+    turn: int, index: int, name: str, tool_input: dict[str, Any]
+) -> dict[str, Any]:
+    return {
+        "type": "tool_use",
+        "id": f"toolu_{turn:04d}_{index}",
+        "name": name,
+        "input": tool_input,
+    }
+
+
+def _stream_events(message: dict[str, Any]) -> bytes:
+    events: list[dict[str, Any]] = [
+        {
+            "type": "message_start",
+            "message": {**message, "content": [], "stop_reason": None},
+        }
+    ]
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            start, delta = {**block, "text": ""}, {
+                "type": "text_delta",
+                "text": block["text"],
+            }
+        else:
+            start = {**block, "input": {}}
+            delta = {
+                "type": "input_json_delta",
+                "partial_json": json.dumps(block["input"]),
+            }
+        events += [
+            {"type": "content_block_start", "index": index, "content_block": start},
+            {"type": "content_block_delta", "index": index, "delta": delta},
+            {"type": "content_block_stop", "index": index},
+        ]
+    events += [
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": message["usage"]["output_tokens"]},
+        },
+        {"type": "message_stop"},
+    ]
+    return "".join(
+        f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events
+    ).encode()
+
+
+def make_screenshots(count: int = SCREENSHOT_VARIANTS) -> list[str]:
+    """Base64 PNGs of screen size, mostly flat with a noisy square, all different."""
+    screenshots = []
+    for seed in range(count):
+        rng = random.Random(seed)
+        image = Image.new("RGB", SCREEN_SIZE, (rng.randrange(256), 128, 200))
+        image.paste(
+            Image.frombytes(
+                "RGB",
+                (NOISE_SIZE, NOISE_SIZE),
+                rng.randbytes(NOISE_SIZE * NOISE_SIZE * 3),
+            ),
+            (
+                rng.randrange(SCREEN_SIZE[0] - NOISE_SIZE),
+                rng.randrange(SCREEN_SIZE[1] - NOISE_SIZE),
+            ),
+        )
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        screenshots.append(base64.b64encode(buffer.getvalue()).decode())
+    return screenshots
+
+
+class FakeComputerTool(BaseAnthropicTool):
+    """Answers every action with the next canned screenshot."""
+
+    def __init__(self, screenshots: list[str], latency: float = 0.0):
+        self._screenshots = screenshots
+        self._latency = latency
+        self._calls = 0
+
+    async def __call__(self, **kwargs) -> ToolResult:
+        await asyncio.sleep(self._latency)
+        self._calls += 1
+        screenshot = self._screenshots[self._calls % len(self._screenshots)]
+        # a fresh string like a real capture, so the history's memory use is counted
+        return ToolResult(base64_image=screenshot[:-1] + screenshot[-1])
+
+    def to_params(self) -> BetaToolUnionParam:
+        return {
+            "name": "computer",
+            "type": "computer_20241022",
+            "display_width_px": SCREEN_SIZE[0],
+            "display_height_px": SCREEN_SIZE[1],
+        }
+
+    def resources(self, **kwargs) -> frozenset[str]:
+        return frozenset({"screen"})
+
+
+class FakeBashTool(BaseAnthropicTool):
+    """Answers every command with `output_lines` lines of made up output."""
+
+    def __init__(self, output_lines: int = 40, latency: float = 0.0):
+        self._output = "\n".join(
+            f"-rw-r--r-- 1 user user {i * 37:>8} Jan  1 00:00 file_{i}.txt"
+            for i in range(output_lines)
+        )
+        self._latency = latency
+
+    async def __call__(self, **kwargs) -> ToolResult:
+        await asyncio.sleep(self._latency)
+        return ToolResult(output=self._output)
+
+    def to_params(self) -> BetaToolUnionParam:
+        return {"name": "bash", "type": "bash_20241022"}
+
+    def resources(self, *, command: str | None = None, **kwargs) -> frozenset[str]:
+        # separate shells, so commands never wait on each other
+        return frozenset()
+
+
+@dataclass
+class BenchmarkResult:
+    turns: int
+    seconds: float
+    # loop time between a response and the next request, tool time excluded
+    overhead_ms_mean: float
+    overhead_ms_p95: float
+    overhead_ms_last_tenth: float
+    setup_ms_mean: float
+    body_kb_first: float
+    body_kb_mean: float
+    body_kb_max: float
+    body_kb_last: float
+    memory_growth_kb: float | None = None
+    memory_peak_kb: float | None = None
+    options: dict[str, Any] = field(default_factory=dict)
+
+
+async def run_session(
+    turns: int,
+    *,
+    screenshots: list[str],
+    tool_latency: float = 0.0,
+    api_latency: float = 0.0,
+    use_image_store: bool = False,
+    **loop_kwargs: Any,
+) -> tuple[
+    MockMessagesServer, SessionMetrics, list[BetaMessageParam], ImageStore | None
+]:
+    metrics = SessionMetrics()
+    image_store = ImageStore() if use_image_store else None
+    messages: list[BetaMessageParam] = [
+        {"role": "user", "content": [{"type": "text", "text": "Benchmark."}]}
+    ]
+    async with MockMessagesServer(turns, api_latency=api_latency) as server:
+        previous_base_url = os.environ.get("ANTHROPIC_BASE_URL")
+        # read by the client when it is created
+        os.environ["ANTHROPIC_BASE_URL"] = server.base_url
+        try:
+            await sampling_loop(
+                model="claude-3-5-sonnet-20241022",
+                provider=APIProvider.ANTHROPIC,
+                system_prompt_suffix="",
+                messages=messages,
+                output_callback=lambda block: None,
+                tool_output_callback=lambda result, tool_use_id: None,
+                api_response_callback=lambda request, response, error: None,
+                api_key="benchmark",
+                metrics=metrics,
+                tool_collection=ToolCollection(
+                    FakeComputerTool(screenshots, tool_latency),
+                    FakeBashTool(latency=tool_latency),
+                ),
+                image_store=image_store,
+                **loop_kwargs,
+            )
+        finally:
+            await close_clients()
+            if previous_base_url is None:
+                del os.environ["ANTHROPIC_BASE_URL"]
+            else:
+                os.environ["ANTHROPIC_BASE_URL"] = previous_base_url
+    return server, metrics, messages, image_store
+
+
+def benchmark(
+    turns: int, *, memory: bool = True, **session_kwargs: Any
+) -> BenchmarkResult:
+    started = time.perf_counter()
+    server, metrics, _, _ = asyncio.run(run_session(turns, **session_kwargs))
+    seconds = time.perf_counter() - started
+
+    overheads = [
+        (arrival - departure - max(turn.tool_seconds.values(), default=0.0)) * 1000
+        for arrival, departure, turn in zip(
+            server.arrivals[1:], server.departures, metrics.turns
+        )
+    ] or [0.0]
+    last_tenth = overheads[-max(1, len(overheads) // 10) :]
+    result = BenchmarkResult(
+        turns=turns,
+        seconds=seconds,
+        overhead_ms_mean=statistics.fmean(overheads),
+        overhead_ms_p95=_percentile(overheads, 0.95),
+        overhead_ms_last_tenth=statistics.fmean(last_tenth),
+        setup_ms_mean=metrics.mean_setup_seconds * 1000,
+        body_kb_first=server.body_bytes[0] / 1024,
+        body_kb_mean=statistics.fmean(server.body_bytes) / 1024,
+        body_kb_max=max(server.body_bytes) / 1024,
+        body_kb_last=server.body_bytes[-1] / 1024,
+        options={
+            key: value for key, value in session_kwargs.items() if key != "screenshots"
+        },
+    )
+    if memory:
+        # a separate run, tracing allocations slows the loop down considerably
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            # the history (and image store) is still referenced, growth is what the
+            # session holds on to
+            _, _, messages, image_store = asyncio.run(
+                run_session(turns, **session_kwargs)
+            )
+            gc.collect()
+            after, peak = tracemalloc.get_traced_memory()
+            del messages, image_store
+        finally:
+            tracemalloc.stop()
+        result.memory_growth_kb = (after - before) / 1024
+        result.memory_peak_kb = (peak - before) / 1024
+    return result
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--tool-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--only-n-most-recent-images", type=int, default=10)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument(
+        "--no-prompt-caching", dest="prompt_caching", action="store_false"
+    )
+    parser.add_argument(
+        "--image-store",
+        action="store_true",
+        help="keep screenshots in an ImageStore instead of the history",
+    )
+    parser.add_argument("--no-memory", dest="memory", action="store_false")
+    parser.add_argument("--json", metavar="PATH", help="also write the results here")
+    args = parser.parse_args(argv)
+
+    screenshots = make_screenshots()
+    results = []
+    for turns in args.turns:
+        result = benchmark(
+            turns,
+            memory=args.memory,
+            screenshots=screenshots,
+            tool_latency=args.tool_latency,
+            api_latency=args.api_latency,
+            only_n_most_recent_images=args.only_n_most_recent_images,
+            stream=args.stream,
+            prompt_caching=args.prompt_caching,
+            use_image_store=args.image_store,
+        )
+        results.append(result)
+        print(
+            f"{turns:>5} turns: overhead/turn {result.overhead_ms_mean:7.2f} ms mean, "
+            f"{result.overhead_ms_p95:7.2f} ms p95, "
+            f"{result.overhead_ms_last_tenth:7.2f} ms last 10% | "
+            f"setup {result.setup_ms_mean:6.2f} ms | "
+            f"body {result.body_kb_first:7.1f} -> {result.body_kb_last:7.1f} KiB "
+            f"(max {result.body_kb_max:.1f}) | "
+            + (
+                f"memory +{result.memory_growth_kb:,.0f} KiB "
+                f"(peak +{result.memory_peak_kb:,.0f})"
+                if result.memory_growth_kb is not None
+                else "memory not measured"
+            )
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Check and benchmark of typing long text on Linux by pasting it from the
+clipboard, against typing it with xdotool and the in-process XTest driver.
+
+    python -m computer_use_demo.benchmarks.paste_benchmark --xvfb
+
+With --xvfb a virtual display is started for the run (Xvfb must be on PATH),
+otherwise the display of $DISPLAY_NUM, or $DISPLAY, is used. An `xclip -out`
+stands in for the focused application answering the paste keys. Every paste
+is checked: the text must arrive intact, the xclip offering it must exit by
+itself after that one request (`-loops 1`), and the clipboard must hold what
+it held before. The run exits with an error otherwise.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import shutil
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+
+from ..tools import clipboard
+from ..tools.computer import TYPING_DELAY_MS, TYPING_GROUP_SIZE, chunks
+from ..tools.run import run
+from ..tools.xinput import XInputDriver
+from .capture_benchmark import XVFB_DISPLAY_NUM, XVFB_SIZE, xvfb
+
+# a line of code with some non-ASCII text, repeated to the length asked for
+LINE = 'def greet(name):  # «héllo» — 0123456789\n    return f"hi {name}!"\n'
+PREVIOUS_CLIPBOARD = b"left on the clipboard by the user"
+
+
+@dataclass
+class PasteResult:
+    method: str
+    chars: int
+    ms_mean: float
+    ms_min: float
+
+
+async def measure(
+    method: str, text: str, send: Callable[[], Awaitable[object]], repeat: int
+) -> PasteResult:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await send()
+        timings.append((time.perf_counter() - start) * 1000)
+    return PasteResult(
+        method=method,
+        chars=len(text),
+        ms_mean=statistics.fmean(timings),
+        ms_min=min(timings),
+    )
+
+
+async def checked_paste(xdisplay: str | None, text: str):
+    """Paste `text` into a stand-in application, raising SystemExit on failure."""
+    received: list[bytes | None] = []
+
+    async def send_paste_keys():
+        received.append(await clipboard.get_clipboard(xdisplay))
+
+    await clipboard.set_clipboard(xdisplay, PREVIOUS_CLIPBOARD)
+    # True only once the owner has exited on its own, after one request
+    if not await clipboard.paste(xdisplay, text, send_paste_keys):
+        raise SystemExit("xclip didn't exit after the text was pasted")
+    if received != [text.encode()]:
+        raise SystemExit(f"the pasted text arrived changed: {received!r}")
+    if await clipboard.get_clipboard(xdisplay) != PREVIOUS_CLIPBOARD:
+        raise SystemExit("the clipboard wasn't restored after the paste")
+
+
+async def xdotool_type(text: str):
+    # as the ComputerTool types without the XTest driver
+    for chunk in chunks(text, TYPING_GROUP_SIZE):
+        returncode, _, stderr = await run(
+            f"xdotool type --delay {TYPING_DELAY_MS} -- {shlex.quote(chunk)}"
+        )
+        if returncode:
+            raise RuntimeError(stderr)
+
+
+async def run_methods(length: int, repeat: int) -> list[PasteResult]:
+    display = os.getenv("DISPLAY_NUM")
+    if display is not None:
+        os.environ["DISPLAY"] = f":{display}"
+    xdisplay = os.getenv("DISPLAY")
+    text = (LINE * (length // len(LINE) + 1))[:length]
+    methods: dict[str, Callable[[], Awaitable[object]]] = {}
+    if clipboard.available():
+        methods["paste"] = lambda: checked_paste(xdisplay, text)
+    else:
+        print("    paste: unavailable (xclip is not installed)")
+    try:
+        xinput = XInputDriver(xdisplay)
+    except OSError as e:
+        print(f"   xinput: unavailable ({e})")
+    else:
+        methods["xinput"] = lambda: xinput.type(text, TYPING_DELAY_MS / 1000)
+    if shutil.which("xdotool"):
+        methods["xdotool"] = lambda: xdotool_type(text)
+    else:
+        print("  xdotool: unavailable (not installed)")
+
+    results = []
+    for method, send in methods.items():
+        result = await measure(method, text, send, repeat)
+        results.append(result)
+        print(
+            f"{method:>9} {result.chars:>6} chars: {result.ms_mean:10.2f} ms mean, "
+            f"{result.ms_min:10.2f} ms min"
+        )
+    if "xinput" in methods:
+        xinput.close()
+    return results
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--length", type=int, default=1000, help="characters typed")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--xvfb", action="store_true", help="paste and type on a virtual display"
+    )
+    parser.add_argument("--json", metavar="PATH", help="also write the results here")
+    args = parser.parse_args(argv)
+
+    if args.xvfb:
+        os.environ["DISPLAY_NUM"] = str(XVFB_DISPLAY_NUM)
+        with xvfb(XVFB_DISPLAY_NUM, XVFB_SIZE):
+            results = asyncio.run(run_methods(args.length, args.repeat))
+    else:
+        results = asyncio.run(run_methods(args.length, args.repeat))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark of screenshot PNG encoding: the in-memory `encode_png` against the
+former temp-file loop of the Windows ComputerTool, on synthetic screenshots.
+
+    python -m computer_use_demo.benchmarks.screenshot_encoding_benchmark
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+
+from PIL import Image, ImageDraw
+
+from ..tools.png import MAX_SCREENSHOT_BYTES, encode_png
+
+SCREEN_SIZE = (1024, 768)
+
+
+def make_ui_screenshot(size: tuple[int, int] = SCREEN_SIZE, seed: int = 0):
+    """Flat panels, buttons and lines of text, like a desktop application."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, size[0], 32), fill=(45, 45, 48))
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(40, size[1])
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((x, y, x + rng.randrange(20, 200), y + 24), fill=color)
+    for row in range(40, size[1], 18):
+        draw.text((12, row), "".join(rng.choice("abcdefgh ") for _ in range(90)))
+    return image
+
+
+def make_photo_screenshot(size: tuple[int, int] = SCREEN_SIZE, seed: int = 0):
+    """A noisy gradient, like a photo or video filling the screen."""
+    rng = random.Random(seed)
+    noise = Image.frombytes("L", size, rng.randbytes(size[0] * size[1]))
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (noise, gradient, Image.blend(noise, gradient, 0.5)))
+
+
+def legacy_encode(image: Image.Image, directory: str) -> bytes:
+    """What the Windows ComputerTool did: save, stat, retry, read back."""
+    path = os.path.join(directory, "screenshot.png")
+    quality = 95
+    while True:
+        image.save(path, "PNG", optimize=True, quality=quality)
+        if os.stat(path).st_size <= 5 * 1024 * 1024 or quality <= 5:
+            break
+        quality -= 5
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@dataclass
+class EncodingResult:
+    image: str
+    encoder: str
+    ms_mean: float
+    ms_min: float
+    kb: float
+    within_limit: bool
+
+
+def measure(
+    name: str, encoder: str, encode: Callable[[], bytes], repeat: int
+) -> EncodingResult:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode()
+        # both end in a base64 string for the API
+        base64.b64encode(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return EncodingResult(
+        image=name,
+        encoder=encoder,
+        ms_mean=statistics.fmean(timings),
+        ms_min=min(timings),
+        kb=len(data) / 1024,
+        within_limit=len(data) <= MAX_SCREENSHOT_BYTES,
+    )
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", metavar="PATH", help="also write the results here")
+    args = parser.parse_args(argv)
+
+    images = {
+        "ui 1024x768": make_ui_screenshot(),
+        "photo 1024x768": make_photo_screenshot(),
+        "photo 2560x1600": make_photo_screenshot((2560, 1600)),
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, image in images.items():
+            for encoder, encode in (
+                ("legacy", lambda: legacy_encode(image, directory)),
+                ("encode_png", lambda: encode_png(image)),
+            ):
+                result = measure(name, encoder, encode, args.repeat)
+                results.append(result)
+                print(
+                    f"{name:>16} {encoder:>10}: {result.ms_mean:8.1f} ms mean, "
+                    f"{result.ms_min:8.1f} ms min | {result.kb:8.1f} KiB"
+                    + ("" if result.within_limit else " (over the limit)")
+                )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
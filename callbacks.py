@@ -0,0 +1,145 @@
+"""
+A queue between the sampling loop and its callbacks, so that slow rendering
+(e.g. decoding screenshots in the streamlit app) doesn't hold up the agent.
+"""
+
+import asyncio
+import contextvars
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+
+import httpx
+from anthropic.types.beta import BetaContentBlockParam
+
+from . import tracing
+from .tools import ToolResult
+
+# pending callbacks before HTTP log renders are dropped, text is coalesced and
+# the loop waits for the consumer at its next turn or tool result
+DEFAULT_MAX_PENDING = 64
+
+
+class CallbackPipeline:
+    """
+    Stands in for the `sampling_loop` callbacks: `output`, `tool_output` and
+    `api_response` only queue the call and return, and a consumer task makes
+    the calls in order on the event loop, while the loop waits on the API or
+    on tools.
+
+    While the consumer is behind, consecutive text blocks are merged into one
+    call. Once `max_pending` calls are queued, successful API responses (the
+    HTTP log) are dropped and counted in `dropped`; message content, tool
+    results and errors are always delivered, and the loop is held back with
+    `wait_for_room` until the consumer catches up. Each call is made in the
+    context (e.g. the tracing span) it was queued in.
+
+    An exception raised by a callback, of any kind, stops the pipeline and is
+    raised again by the next call queued, by `wait_for_room` and by `aclose`,
+    which waits for the queue to drain.
+    """
+
+    def __init__(
+        self,
+        output_callback: Callable[[BetaContentBlockParam], None],
+        tool_output_callback: Callable[[ToolResult, str], None],
+        api_response_callback: Callable[
+            [httpx.Request, httpx.Response | object | None, Exception | None], None
+        ],
+        *,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ):
+        self._output_callback = output_callback
+        self._tool_output_callback = tool_output_callback
+        self._api_response_callback = api_response_callback
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.coalesced = 0
+        self._pending: deque[
+            tuple[Callable[..., None], tuple[Any, ...], contextvars.Context]
+        ] = deque()
+        self._wakeup = asyncio.Event()
+        # set while fewer than max_pending calls are queued
+        self._room = asyncio.Event()
+        self._room.set()
+        self._closing = False
+        self._error: BaseException | None = None
+        self._consumer = asyncio.create_task(self._consume())
+
+    def output(self, content_block: BetaContentBlockParam):
+        self._raise_error()
+        if content_block["type"] == "text" and self._pending:
+            callback, args, context = self._pending[-1]
+            if callback is self._output_callback and args[0]["type"] == "text":
+                text = args[0]["text"] + content_block["text"]
+                self._pending[-1] = (
+                    callback,
+                    ({"type": "text", "text": text},),
+                    context,
+                )
+                self.coalesced += 1
+                return
+        self._put(self._output_callback, content_block)
+
+    def tool_output(self, result: ToolResult, tool_use_id: str):
+        self._raise_error()
+        self._put(self._tool_output_callback, result, tool_use_id)
+
+    def api_response(
+        self,
+        request: httpx.Request,
+        response: httpx.Response | object | None,
+        error: Exception | None,
+    ):
+        self._raise_error()
+        if error is None and len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._put(self._api_response_callback, request, response, error)
+
+    async def wait_for_room(self):
+        """Return once fewer than `max_pending` calls are queued."""
+        self._raise_error()
+        if not self._room.is_set():
+            with tracing.span("callbacks.wait", pending=len(self._pending)):
+                await self._room.wait()
+            self._raise_error()
+
+    async def aclose(self):
+        """Make the calls still queued, then stop the consumer."""
+        self._closing = True
+        self._wakeup.set()
+        await asyncio.shield(self._consumer)
+        self._raise_error()
+
+    def _put(self, callback: Callable[..., None], *args: Any):
+        self._pending.append((callback, args, contextvars.copy_context()))
+        if len(self._pending) >= self.max_pending:
+            self._room.clear()
+        self._wakeup.set()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    async def _consume(self):
+        while True:
+            while not self._pending:
+                if self._closing:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            callback, args, context = self._pending.popleft()
+            if len(self._pending) < self.max_pending:
+                self._room.set()
+            try:
+                context.run(callback, *args)
+            # streamlit stops and reruns scripts with BaseExceptions, which must
+            # reach the sampling loop as they did from a direct call
+            except BaseException as e:
+                self._error = e
+                self._pending.clear()
+                self._room.set()
+                return
+            # let the sampling loop run between calls
+            await asyncio.sleep(0)
@@ -0,0 +1,279 @@
+"""
+Headless entrypoint that runs a batch of tasks without the streamlit UI.
+
+    python -m computer_use_demo.cli tasks.jsonl --output trajectories.jsonl
+
+Each line of the tasks file is a JSON object with a `prompt`, and optionally an
+`id`, a `system_prompt_suffix` and a `priority`. Events of every task are
+appended to the output file as they happen, one JSON object per line, each
+tagged with the `task_id`: a `turn` event with the timings and usage of each
+turn is written as soon as the turn is over.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import asdict
+from typing import IO, Any
+
+import httpx
+from anthropic.types.beta import BetaContentBlockParam, BetaMessageParam
+
+from . import tracing
+from .clients import APIProvider, close_clients
+from .loop import PROVIDER_TO_DEFAULT_MODEL_NAME
+from .metrics import SessionMetrics, TurnMetrics
+from .orchestrator import Orchestrator
+from .replay import Cassette
+from .tools import ToolResult
+
+
+class TrajectoryWriter:
+    """Appends events as JSON lines, flushing each one so partial runs are kept."""
+
+    def __init__(self, file: IO[str], *, include_images: bool = False):
+        self._file = file
+        self._include_images = include_images
+
+    def write(self, task_id: str, event: str, **fields: Any):
+        record = {"task_id": task_id, "event": event, "time": time.time(), **fields}
+        self._file.write(json.dumps(record, default=self._default) + "\n")
+        self._file.flush()
+
+    def messages(self, messages: list[BetaMessageParam]) -> list[BetaMessageParam]:
+        """The messages as they are written out, images replaced by their hash."""
+        if self._include_images:
+            return messages
+        return json.loads(
+            json.dumps(messages, default=self._default), object_hook=_omit_image
+        )
+
+    @staticmethod
+    def _default(value: Any) -> Any:
+        return str(value)
+
+
+def _omit_image(block: dict[str, Any]) -> dict[str, Any]:
+    if block.get("type") == "base64" and isinstance(block.get("data"), str):
+        digest = hashlib.sha256(block["data"].encode()).hexdigest()
+        return {**block, "data": f"<omitted sha256:{digest}>"}
+    return block
+
+
+def load_tasks(path: str) -> list[dict[str, Any]]:
+    tasks = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if not isinstance(task, dict) or not isinstance(task.get("prompt"), str):
+                raise ValueError(
+                    f"{path}:{line_number}: expected an object with a prompt"
+                )
+            task.setdefault("id", str(line_number))
+            tasks.append(task)
+    return tasks
+
+
+async def run_task(
+    task: dict[str, Any],
+    *,
+    orchestrator: Orchestrator,
+    writer: TrajectoryWriter,
+    args: argparse.Namespace,
+    cassette: Cassette | None,
+) -> bool:
+    """Run one task, writing its events; returns whether it completed."""
+    task_id = str(task["id"])
+    messages: list[BetaMessageParam] = [
+        {"role": "user", "content": [{"type": "text", "text": task["prompt"]}]}
+    ]
+    metrics = SessionMetrics()
+    writer.write(task_id, "start", prompt=task["prompt"])
+
+    def output_callback(block: BetaContentBlockParam):
+        writer.write(task_id, "content", block=block)
+
+    def tool_output_callback(result: ToolResult, tool_use_id: str):
+        writer.write(
+            task_id,
+            "tool_result",
+            tool_use_id=tool_use_id,
+            output=result.output,
+            error=result.error,
+            system=result.system,
+            has_image=bool(result.base64_image),
+        )
+
+    def api_response_callback(
+        request: httpx.Request,
+        response: httpx.Response | object | None,
+        error: Exception | None,
+    ):
+        # streamed or successful responses are covered by the turn metrics
+        if error is not None:
+            writer.write(task_id, "api_error", error=repr(error))
+
+    def turn_callback(turn: TurnMetrics):
+        writer.write(task_id, "turn", **asdict(turn))
+
+    status = "completed"
+    started = time.monotonic()
+    try:
+        await orchestrator.run_session(
+            model=args.model,
+            provider=args.provider,
+            system_prompt_suffix=task.get("system_prompt_suffix", ""),
+            messages=messages,
+            output_callback=output_callback,
+            tool_output_callback=tool_output_callback,
+            api_response_callback=api_response_callback,
+            api_key=args.api_key,
+            only_n_most_recent_images=args.only_n_most_recent_images,
+            max_tokens=args.max_tokens,
+            metrics=metrics,
+            turn_callback=turn_callback,
+            max_turns=args.max_turns,
+            timeout=args.timeout,
+            priority=task.get("priority", 0),
+            cassette=cassette,
+        )
+        if metrics.deadline_reached:
+            status = "timeout"
+    except Exception as e:
+        status = "error"
+        writer.write(task_id, "error", error=repr(e))
+    if (
+        status == "completed"
+        and args.max_turns is not None
+        and (len(metrics.turns) >= args.max_turns and messages[-1]["role"] == "user")
+    ):
+        status = "max_turns"
+
+    writer.write(
+        task_id,
+        "end",
+        status=status,
+        seconds=time.monotonic() - started,
+        turns=[asdict(turn) for turn in metrics.turns],
+        messages=writer.messages(messages),
+    )
+    return status != "error"
+
+
+async def run(args: argparse.Namespace) -> int:
+    tasks = load_tasks(args.tasks)
+    if args.trace:
+        tracing.configure(tracing.JsonlExporter(args.trace))
+    elif args.otlp_endpoint:
+        tracing.configure(tracing.OtlpHttpExporter(args.otlp_endpoint))
+    else:
+        tracing.configure_from_env()
+    orchestrator = Orchestrator(
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        max_concurrent_sessions=args.concurrency,
+    )
+    cassette = None
+    if args.record or args.replay:
+        cassette = Cassette(
+            args.record or args.replay,
+            "record" if args.record else "replay",
+            match_tool_results=not args.ignore_tool_results,
+        )
+    with open(args.output, "a") as f:
+        writer = TrajectoryWriter(f, include_images=args.include_images)
+        try:
+            results = await asyncio.gather(
+                *(
+                    run_task(
+                        task,
+                        orchestrator=orchestrator,
+                        writer=writer,
+                        args=args,
+                        cassette=cassette,
+                    )
+                    for task in tasks
+                )
+            )
+        finally:
+            await close_clients()
+    return 0 if all(results) else 1
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m computer_use_demo.cli", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("tasks", help="JSONL file with one task per line")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="trajectories.jsonl",
+        help="JSONL file events are appended to",
+    )
+    parser.add_argument(
+        "--provider",
+        type=APIProvider,
+        choices=list(APIProvider),
+        default=APIProvider(os.getenv("API_PROVIDER") or APIProvider.ANTHROPIC),
+    )
+    parser.add_argument("--model", help="defaults to the provider's default model")
+    parser.add_argument(
+        "--api-key",
+        default=os.getenv("ANTHROPIC_API_KEY", ""),
+        help="defaults to $ANTHROPIC_API_KEY",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="tasks run at the same time"
+    )
+    parser.add_argument("--max-turns", type=int, help="model requests per task")
+    parser.add_argument("--timeout", type=float, help="wall clock seconds per task")
+    parser.add_argument("--max-tokens", type=int, default=4096)
+    parser.add_argument("--only-n-most-recent-images", type=int, default=10)
+    parser.add_argument("--requests-per-minute", type=float)
+    parser.add_argument("--tokens-per-minute", type=float)
+    parser.add_argument(
+        "--include-images",
+        action="store_true",
+        help="keep screenshots in the written messages instead of their hash",
+    )
+    trace = parser.add_mutually_exclusive_group()
+    trace.add_argument(
+        "--trace", metavar="PATH", help="append tracing spans to a JSONL file"
+    )
+    trace.add_argument(
+        "--otlp-endpoint",
+        metavar="URL",
+        help="send tracing spans to an OTLP/HTTP collector, e.g. "
+        "http://localhost:4318/v1/traces",
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record", metavar="DIR", help="record the API exchanges into DIR"
+    )
+    cassette.add_argument(
+        "--replay", metavar="DIR", help="serve the API responses recorded in DIR"
+    )
+    parser.add_argument(
+        "--ignore-tool-results",
+        action="store_true",
+        help="match recorded requests regardless of tool outputs",
+    )
+    args = parser.parse_args(argv)
+    if args.model is None:
+        args.model = PROVIDER_TO_DEFAULT_MODEL_NAME[args.provider]
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    return asyncio.run(run(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Pooled async API clients shared across turns (and sessions) of the sampling loop.
+
+Creating a client per turn throws away the underlying httpx connection pool, so
+every request pays for a new TCP/TLS handshake and, for Bedrock/Vertex, a fresh
+credential lookup. Clients are cached per provider and credentials instead, and
+closed explicitly with `close_clients`.
+
+Async clients are bound to the event loop they were first used on, so the cache
+is also keyed on the running loop (streamlit starts a fresh loop on every rerun).
+"""
+
+import asyncio
+from enum import StrEnum
+from typing import TYPE_CHECKING
+
+import httpx
+from anthropic import (
+    APIError,
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
+)
+
+from .request_body import ENCODED_BODIES_SUPPORTED, EncodedBodyClient
+
+if TYPE_CHECKING:
+    from .replay import Cassette
+
+# keep enough idle connections around for a handful of concurrent sessions
+MAX_KEEPALIVE_CONNECTIONS = 10
+MAX_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 120.0  # seconds
+
+
+class APIProvider(StrEnum):
+    ANTHROPIC = "anthropic"
+    BEDROCK = "bedrock"
+    VERTEX = "vertex"
+
+
+Client = AsyncAnthropic | AsyncAnthropicBedrock | AsyncAnthropicVertex
+
+_clients: dict[
+    tuple[asyncio.AbstractEventLoop, APIProvider, str | None, "Cassette | None"],
+    Client,
+] = {}
+
+
+def _make_http_client(cassette: "Cassette | None" = None) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    if cassette is None:
+        return httpx.AsyncClient(limits=limits)
+    # replaying never touches the network
+    wrapped = (
+        httpx.AsyncHTTPTransport(limits=limits) if cassette.mode == "record" else None
+    )
+    return httpx.AsyncClient(transport=cassette.transport(wrapped))
+
+
+def get_client(
+    provider: APIProvider,
+    api_key: str | None = None,
+    cassette: "Cassette | None" = None,
+) -> Client:
+    """
+    Return the pooled client for the provider, creating it on first use. With a
+    `cassette`, the client records its exchanges to it or replays them from it.
+    """
+    loop = asyncio.get_running_loop()
+    # clients of loops that have since closed can't be used (or closed) anymore,
+    # code running on short-lived loops calls `close_clients` before they end
+    for stale_key in [key for key in _clients if key[0].is_closed()]:
+        del _clients[stale_key]
+
+    key = (
+        loop,
+        provider,
+        api_key if provider == APIProvider.ANTHROPIC else None,
+        cassette,
+    )
+    if (client := _clients.get(key)) is not None:
+        return client
+
+    http_client = _make_http_client(cassette)
+    # retries are scheduled by the sampling loop, see `retry.RetryPolicy`
+    if provider == APIProvider.ANTHROPIC and ENCODED_BODIES_SUPPORTED:
+        # also sends the bodies the sampling loop encodes itself
+        client = EncodedBodyClient(
+            api_key=api_key, http_client=http_client, max_retries=0
+        )
+    elif provider == APIProvider.ANTHROPIC:
+        client = AsyncAnthropic(api_key=api_key, http_client=http_client, max_retries=0)
+    elif provider == APIProvider.VERTEX:
+        client = AsyncAnthropicVertex(http_client=http_client, max_retries=0)
+    elif provider == APIProvider.BEDROCK:
+        client = AsyncAnthropicBedrock(http_client=http_client, max_retries=0)
+    else:
+        raise ValueError(f"Unknown API provider: {provider}")
+    _clients[key] = client
+    return client
+
+
+async def warm_up(
+    provider: APIProvider,
+    api_key: str | None = None,
+    cassette: "Cassette | None" = None,
+) -> Client:
+    """
+    Open a connection (and resolve credentials) ahead of the first turn.
+
+    Any cheap request against the base url does the job: the response itself is
+    irrelevant, the pooled connection left behind is what we want.
+    """
+    client = get_client(provider, api_key, cassette)
+    try:
+        await client.get("/", cast_to=httpx.Response, options={"max_retries": 0})
+    except (APIError, httpx.HTTPError):
+        pass
+    return client
+
+
+async def close_clients():
+    """Close the pooled clients of the running event loop and their connections."""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _clients if key[0] is loop]:
+        await _clients.pop(key).close()
@@ -0,0 +1,231 @@
+"""
+Bookkeeping over the message history that the sampling loop keeps between turns.
+"""
+
+from collections import deque
+from collections.abc import Callable
+from typing import cast
+
+from anthropic.types.beta import (
+    BetaImageBlockParam,
+    BetaMessageParam,
+    BetaToolResultBlockParam,
+)
+
+from .tokens import (
+    RequestEstimate,
+    estimate_block_bytes,
+    estimate_block_tokens,
+    estimate_message_bytes,
+    estimate_message_tokens,
+)
+
+# tools whose old text output is replaced with a stub by ToolResultCompactor
+COMPACTED_TOOLS = frozenset({"bash", "str_replace_editor"})
+# outputs shorter than this are left alone, a stub wouldn't be much smaller
+COMPACTED_MIN_CHARS = 1000
+# lines kept at each end of a stub, at most COMPACTED_MIN_CHARS // 2 characters
+COMPACTED_STUB_LINES = 5
+
+
+class ImageLedger:
+    """
+    Positions of the tool_result images in a message history, oldest first.
+
+    The ledger is filled once from the existing history and then kept up to date
+    with `add_message` as the loop appends messages, so pruning old screenshots
+    costs time in proportion to the images removed, not to the history length.
+    """
+
+    def __init__(
+        self,
+        messages: list[BetaMessageParam] | None = None,
+        *,
+        on_remove: Callable[[BetaToolResultBlockParam], None] | None = None,
+    ):
+        self._images: deque[tuple[BetaToolResultBlockParam, BetaImageBlockParam]] = (
+            deque()
+        )
+        self._on_remove = on_remove
+        for message in messages or []:
+            self.add_message(message)
+
+    def __len__(self):
+        return len(self._images)
+
+    def add_message(self, message: BetaMessageParam):
+        """Record the tool_result images of a message appended to the history."""
+        if not isinstance(message["content"], list):
+            return
+        for item in message["content"]:
+            if not (isinstance(item, dict) and item.get("type") == "tool_result"):
+                continue
+            tool_result = cast(BetaToolResultBlockParam, item)
+            if not isinstance(content := tool_result.get("content"), list):
+                continue
+            for block in content:
+                if isinstance(block, dict) and block.get("type") == "image":
+                    self._images.append((tool_result, cast(BetaImageBlockParam, block)))
+
+    def prune(self, images_to_keep: int, min_removal_threshold: int) -> int:
+        """
+        Remove all but the final `images_to_keep` images in place, in chunks of
+        `min_removal_threshold` to reduce how often we break the prompt cache.
+        Returns the number of images removed.
+        """
+        images_to_remove = len(self._images) - images_to_keep
+        # for better cache behavior, we want to remove in chunks
+        images_to_remove -= images_to_remove % min_removal_threshold
+        for _ in range(max(images_to_remove, 0)):
+            self.remove_oldest()
+        return max(images_to_remove, 0)
+
+    def remove_oldest(self) -> BetaImageBlockParam:
+        """Remove the oldest remaining image from its tool_result and return it."""
+        tool_result, image = self._images.popleft()
+        tool_result["content"] = [
+            block for block in tool_result.get("content", []) if block is not image
+        ]
+        if self._on_remove is not None:
+            self._on_remove(tool_result)
+        return image
+
+
+def trim_to_budget(
+    messages: list[BetaMessageParam],
+    image_ledger: ImageLedger,
+    estimate: RequestEstimate,
+    *,
+    max_tokens: int | None = None,
+    max_bytes: int | None = None,
+) -> tuple[int, int]:
+    """
+    Deterministically shrink the history in place until the estimated request
+    fits the budget: first drop tool_result images oldest first, then drop the
+    oldest assistant/user exchanges after the initial user message. The newest
+    exchange is always kept, so the request may still end up over budget.
+    Returns the number of images and messages removed.
+    """
+    tokens, size = estimate.tokens, estimate.bytes
+
+    def over_budget():
+        return (max_tokens is not None and tokens > max_tokens) or (
+            max_bytes is not None and size > max_bytes
+        )
+
+    images_removed = 0
+    while over_budget() and len(image_ledger):
+        image = image_ledger.remove_oldest()
+        tokens -= estimate_block_tokens(image)
+        size -= estimate_block_bytes(image)
+        images_removed += 1
+
+    # the ledger is empty from here on, no image bookkeeping is needed
+    messages_removed = 0
+    while (
+        over_budget()
+        and len(messages) > 3
+        and messages[1]["role"] == "assistant"
+        and messages[2]["role"] == "user"
+    ):
+        for message in messages[1:3]:
+            tokens -= estimate_message_tokens(message)
+            size -= estimate_message_bytes(message)
+        del messages[1:3]
+        messages_removed += 2
+    return images_removed, messages_removed
+
+
+class ToolResultCompactor:
+    """
+    Replaces the text of old bash/editor tool results with short stubs.
+
+    Tool results stay in the history forever, so without compaction every request
+    resends them, e.g. each `cat -n` of a file. Results are compacted once they are
+    more than `keep_turns` turns old, in chunks of `chunk_turns` turns at a time,
+    so (like image pruning) the cached prefix is only broken now and then.
+    """
+
+    def __init__(
+        self,
+        messages: list[BetaMessageParam] | None = None,
+        *,
+        tool_names: frozenset[str] = COMPACTED_TOOLS,
+    ):
+        self.tool_names = tool_names
+        self._tool_names_by_id: dict[str, str] = {}
+        # tool results not compacted yet, with the turn they were added in
+        self._pending: deque[tuple[int, BetaToolResultBlockParam]] = deque()
+        self._turns = 0
+        for message in messages or []:
+            self.add_message(message)
+
+    def add_message(self, message: BetaMessageParam):
+        """Record a message appended to the history."""
+        if not isinstance(message["content"], list):
+            return
+        if message["role"] == "assistant":
+            for block in message["content"]:
+                if isinstance(block, dict) and block.get("type") == "tool_use":
+                    self._tool_names_by_id[block["id"]] = block["name"]
+            return
+        tool_results = [
+            cast(BetaToolResultBlockParam, block)
+            for block in message["content"]
+            if isinstance(block, dict) and block.get("type") == "tool_result"
+        ]
+        if not tool_results:
+            return
+        self._turns += 1
+        for tool_result in tool_results:
+            name = self._tool_names_by_id.pop(tool_result["tool_use_id"], None)
+            if name in self.tool_names:
+                self._pending.append((self._turns, tool_result))
+
+    def compact(self, keep_turns: int, chunk_turns: int) -> int:
+        """
+        Compact the tool results older than `keep_turns` turns once at least
+        `chunk_turns` turns are due. Returns the number of characters saved.
+        """
+        if not self._pending:
+            return 0
+        due_turns = self._turns - keep_turns - self._pending[0][0] + 1
+        if due_turns < chunk_turns:
+            return 0
+        # compact whole chunks only, counted from the oldest pending turn
+        last_turn = self._pending[0][0] + due_turns - due_turns % chunk_turns - 1
+        saved = 0
+        while self._pending and self._pending[0][0] <= last_turn:
+            _, tool_result = self._pending.popleft()
+            saved += _compact_tool_result(tool_result)
+        return saved
+
+
+def _compact_tool_result(tool_result: BetaToolResultBlockParam) -> int:
+    content = tool_result.get("content")
+    if isinstance(content, str):
+        stub = _stub(content)
+        tool_result["content"] = stub
+        return len(content) - len(stub)
+    saved = 0
+    for block in content or []:
+        if isinstance(block, dict) and block.get("type") == "text":
+            stub = _stub(block["text"])
+            saved += len(block["text"]) - len(stub)
+            block["text"] = stub
+    return saved
+
+
+def _stub(text: str) -> str:
+    """Shorten text to its first and last lines plus a note on its size."""
+    if len(text) <= COMPACTED_MIN_CHARS:
+        return text
+    lines = text.split("\n")
+    # long lines are cut too, a few of them can be most of the text
+    head = "\n".join(lines[:COMPACTED_STUB_LINES])[: COMPACTED_MIN_CHARS // 2]
+    tail = "\n".join(lines[-COMPACTED_STUB_LINES:])[-(COMPACTED_MIN_CHARS // 2) :]
+    note = (
+        f"<compacted>old tool output of {len(lines)} lines ({len(text)} characters),"
+        " only its start and end are kept</compacted>"
+    )
+    return "\n".join([head, note, tail])
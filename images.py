@@ -0,0 +1,221 @@
+"""
+A content-addressed store for the screenshots of a session, so the message
+history holds short references instead of base64 text, and the base64 blocks
+the API expects are only built for the request being sent.
+"""
+
+import base64
+import hashlib
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, cast
+
+from anthropic.types.beta import BetaImageBlockParam, BetaMessageParam
+
+from .tokens import png_size
+
+# about a hundred full-screen screenshots
+DEFAULT_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+EVICTED_IMAGE_TEXT = "[This image is no longer available.]"
+
+
+class ImageStore:
+    """
+    Images stored once as raw bytes, keyed on their sha256. The least recently
+    used ones are spilled to files in `spill_dir` (a temporary directory by
+    default) once they take more than `max_memory_bytes`, and files are
+    deleted, oldest first, once they take more than `max_disk_bytes`.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES,
+        *,
+        spill_dir: str | Path | None = None,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.spilled = 0
+        self.evicted = 0
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        # sizes of the spilled images, least recently used first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self._cleanup: weakref.finalize | None = None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._memory or key in self._disk
+
+    def put(self, data: bytes) -> str:
+        """Store `data` unless it is stored already, and return its key."""
+        key = hashlib.sha256(data).hexdigest()
+        if key in self._memory:
+            self._memory.move_to_end(key)
+        elif key not in self._disk:
+            self._add(key, data)
+        return key
+
+    def get(self, key: str) -> bytes | None:
+        """The stored bytes, or None if the image has been evicted."""
+        if (data := self._memory.get(key)) is not None:
+            self._memory.move_to_end(key)
+            return data
+        if key not in self._disk:
+            return None
+        try:
+            data = (self._directory() / key).read_bytes()
+        except OSError:
+            self._forget_file(key)
+            self.evicted += 1
+            return None
+        # the file is kept, spilling the image again needs no write
+        self._disk.move_to_end(key)
+        self._add(key, data)
+        return data
+
+    def close(self):
+        """Delete the spilled files."""
+        for key in list(self._disk):
+            self._delete_file(key)
+        if self._cleanup is not None:
+            self._cleanup()
+        self._memory.clear()
+        self.memory_bytes = 0
+
+    def _add(self, key: str, data: bytes):
+        self._memory[key] = data
+        self.memory_bytes += len(data)
+        # the newest image always stays in memory
+        while self.memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            spilled_key, spilled = self._memory.popitem(last=False)
+            self.memory_bytes -= len(spilled)
+            self._spill(spilled_key, spilled)
+
+    def _spill(self, key: str, data: bytes):
+        if key in self._disk:
+            return
+        if len(data) > self.max_disk_bytes:
+            self.evicted += 1
+            return
+        try:
+            (self._directory() / key).write_bytes(data)
+        except OSError:
+            self.evicted += 1
+            return
+        self._disk[key] = len(data)
+        self.disk_bytes += len(data)
+        self.spilled += 1
+        while self.disk_bytes > self.max_disk_bytes:
+            oldest = next(iter(self._disk))
+            self._delete_file(oldest)
+            if oldest not in self._memory:
+                self.evicted += 1
+
+    def _directory(self) -> Path:
+        if self._spill_dir is None:
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="computer-use-images-"))
+            self._cleanup = weakref.finalize(
+                self, shutil.rmtree, self._spill_dir, ignore_errors=True
+            )
+        else:
+            self._spill_dir.mkdir(parents=True, exist_ok=True)
+        return self._spill_dir
+
+    def _delete_file(self, key: str):
+        (self._directory() / key).unlink(missing_ok=True)
+        self._forget_file(key)
+
+    def _forget_file(self, key: str):
+        self.disk_bytes -= self._disk.pop(key)
+
+
+def image_ref(
+    store: ImageStore, base64_image: str, media_type: str = "image/png"
+) -> BetaImageBlockParam:
+    """
+    Store a base64 image and return an image block that refers to it, with the
+    dimensions and size needed to estimate the request without the data.
+    """
+    data = base64.b64decode(base64_image)
+    width, height = png_size(data)
+    return cast(
+        BetaImageBlockParam,
+        {
+            "type": "image",
+            "source": {
+                "type": "image_ref",
+                "media_type": media_type,
+                "sha256": store.put(data),
+                "size": len(data),
+                "width": width,
+                "height": height,
+            },
+        },
+    )
+
+
+def materialize(
+    messages: list[BetaMessageParam], store: ImageStore
+) -> list[BetaMessageParam]:
+    """
+    The messages with every image reference replaced by a base64 image block,
+    ready to send. Messages without references are passed as they are, the
+    others are copied, so `messages` itself keeps its references. An evicted
+    image is replaced by a short note.
+    """
+    return [_materialize_message(message, store) for message in messages]
+
+
+def _materialize_message(
+    message: BetaMessageParam, store: ImageStore
+) -> BetaMessageParam:
+    content = message["content"]
+    if not isinstance(content, list) or not any(map(_has_ref, content)):
+        return message
+    return cast(
+        BetaMessageParam,
+        {**message, "content": [_materialize_block(block, store) for block in content]},
+    )
+
+
+def _has_ref(block: Any) -> bool:
+    if not isinstance(block, dict):
+        return False
+    if block.get("type") == "image":
+        return block["source"].get("type") == "image_ref"
+    if block.get("type") == "tool_result" and isinstance(
+        content := block.get("content"), list
+    ):
+        return any(map(_has_ref, content))
+    return False
+
+
+def _materialize_block(block: Any, store: ImageStore) -> Any:
+    if not _has_ref(block):
+        return block
+    if block["type"] == "tool_result":
+        return {
+            **block,
+            "content": [_materialize_block(item, store) for item in block["content"]],
+        }
+    source = block["source"]
+    if (data := store.get(source["sha256"])) is None:
+        note = {"type": "text", "text": EVICTED_IMAGE_TEXT}
+        if "cache_control" in block:
+            note["cache_control"] = block["cache_control"]
+        return note
+    return {
+        **block,
+        "source": {
+            "type": "base64",
+            "media_type": source["media_type"],
+            "data": base64.b64encode(data).decode(),
+        },
+    }
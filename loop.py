@@ -2,35 +2,51 @@
 Agentic sampling loop that calls the Anthropic API and local implementation of anthropic-defined computer use tools.
 """
 
+import asyncio
+import json
 import platform
-from collections.abc import Callable
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
 from datetime import datetime
-from enum import StrEnum
 from typing import Any, cast
 
 import httpx
 from anthropic import (
-    Anthropic,
-    AnthropicBedrock,
-    AnthropicVertex,
     APIError,
     APIResponseValidationError,
     APIStatusError,
+    AsyncStream,
 )
 from anthropic.types.beta import (
-    BetaCacheControlEphemeralParam,
     BetaContentBlockParam,
     BetaImageBlockParam,
     BetaMessage,
     BetaMessageParam,
+    BetaRawMessageStreamEvent,
     BetaTextBlock,
     BetaTextBlockParam,
     BetaToolResultBlockParam,
+    BetaToolUseBlock,
     BetaToolUseBlockParam,
 )
 
 import platform
+from . import tracing
+from .callbacks import CallbackPipeline
+from .clients import APIProvider, get_client, warm_up
+from .history import ImageLedger, ToolResultCompactor, trim_to_budget
+from .images import ImageStore, image_ref, materialize
+from .metrics import SessionMetrics, TurnMetrics
+from .prompt_cache import CachePlanner
+from .rate_limit import RateLimiter
+from .replay import Cassette
+from .request_body import EncodedBodyClient, RequestBodyBuilder, post_message
+from .retry import RetryPolicy
+from .screenshots import ScreenshotDeduplicator
+from .tokens import estimate_request, estimate_text_tokens, estimate_tools_tokens
 from .tools import EditTool, ToolCollection, ToolResult
+from .tools.base import ToolFailure
 
 # Import platform-specific implementations
 if platform.system() == 'Windows':
@@ -43,11 +59,11 @@ else:
 COMPUTER_USE_BETA_FLAG = "computer-use-2024-10-22"
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
 
-
-class APIProvider(StrEnum):
-    ANTHROPIC = "anthropic"
-    BEDROCK = "bedrock"
-    VERTEX = "vertex"
+# how long cancelled tool calls get to kill their subprocesses
+TOOL_CANCEL_GRACE_SECONDS = 5.0
+TOOL_CANCELLED_TEXT = (
+    "The tool call was cancelled before it finished: the session was stopped."
+)
 
 
 PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
@@ -92,97 +108,436 @@ async def sampling_loop(
     api_key: str,
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
+    warm_up_client: bool = False,
+    metrics: SessionMetrics | None = None,
+    turn_callback: Callable[[TurnMetrics], None] | None = None,
+    stream: bool = False,
+    tool_concurrency_limits: dict[str, int] | None = None,
+    prompt_caching: bool | None = None,
+    max_request_tokens: int | None = None,
+    max_request_bytes: int | None = None,
+    compact_tool_results_after: int | None = None,
+    compaction_chunk_turns: int = 10,
+    screenshot_deduplicator: ScreenshotDeduplicator | None = None,
+    retry_policy: RetryPolicy | None = RetryPolicy(),
+    rate_limiter: RateLimiter | None = None,
+    priority: int = 0,
+    max_turns: int | None = None,
+    deadline: float | None = None,
+    callback_queue_size: int | None = None,
+    image_store: ImageStore | None = None,
+    cassette: Cassette | None = None,
+    tool_collection: ToolCollection | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    API clients are pooled across turns and sessions (see `clients.py`); pass
+    `warm_up_client=True` to open the connection before the first turn. Per-turn
+    timings are recorded into `metrics` when provided, and each turn's metrics
+    are passed to `turn_callback` as soon as the turn is over, however it ended.
+
+    With `stream=True` the response is streamed: text deltas are passed to
+    `output_callback` as they arrive, and each tool_use block starts running as
+    soon as its input is complete, while later blocks are still being generated.
+
+    Tool calls within a turn that don't conflict (see `ToolCollection.submit`) run
+    concurrently, like editor calls on different files; bash commands run alone,
+    in order with every other call. `tool_concurrency_limits` caps concurrent
+    calls per tool name.
+
+    Prompt caching is on by default for the Anthropic API only; `prompt_caching`
+    overrides that for providers that support it. Breakpoints are placed by a
+    `CachePlanner`, and cache reads/writes are recorded per turn into `metrics`.
+
+    `max_request_tokens` and `max_request_bytes` set a per-request budget, checked
+    against an offline estimate before sending; over budget, the oldest screenshots
+    and then the oldest exchanges are trimmed from `messages` (see `trim_to_budget`).
+
+    With `compact_tool_results_after` set, bash/editor output older than that many
+    turns is replaced with short stubs, `compaction_chunk_turns` turns at a time.
+
+    A `screenshot_deduplicator` replaces screenshots of an unchanged screen with a
+    short note, and counts the images and image tokens saved.
+
+    Rate limited, overloaded and connection-failed requests are retried according
+    to `retry_policy` (which replaces the SDK's own retries); retries and the time
+    spent waiting are recorded per turn. `retry_policy=None` disables retries.
+
+    A `rate_limiter` shared between sessions (see `orchestrator.py`) delays each
+    request until the shared request and token budgets allow it, lower `priority`
+    values going first.
+
+    With `max_turns` set, the loop stops after that many requests to the model,
+    and with a `deadline` (in `time.monotonic()` seconds, like the event loop's
+    clock) once it passes: the request or tool calls in flight are cancelled,
+    their subprocesses killed, and tool calls that didn't finish get an error
+    result. Either way the returned history ends on a user message and can be
+    resumed by calling `sampling_loop` again. The same clean up happens before
+    a cancellation of the task running the loop is let through.
+
+    With `callback_queue_size` set, the callbacks are queued and called from a
+    separate task (see `CallbackPipeline`), so slow rendering overlaps the API
+    and tool calls instead of adding to every turn; at most that many calls
+    wait before HTTP log entries are dropped, text is merged and the loop waits
+    for the queue at its next turn or tool result. The queue is drained before
+    the loop returns.
+
+    With an `image_store`, screenshots are kept in the store once as bytes and
+    `messages` only holds references to them (see `images.py`); the base64
+    image blocks are built for each request as it is sent.
+
+    Requests to the Anthropic API are encoded incrementally (see
+    `RequestBodyBuilder`): messages unchanged since the previous request are
+    not encoded again.
+
+    A `cassette` (see `replay.py`) records every API exchange to disk, or
+    replays a recorded session offline.
+
+    Pass a `tool_collection` to run other tools than the default computer, bash
+    and editor tools (`tool_concurrency_limits` then has no effect).
     """
-    tool_collection = ToolCollection(
-        ComputerTool(),
-        BashTool(),
-        EditTool(),
+    if tool_collection is None:
+        tool_collection = ToolCollection(
+            ComputerTool(),
+            BashTool(),
+            EditTool(),
+            concurrency_limits=tool_concurrency_limits,
+        )
+    # each call gets its own span when tracing is enabled
+    output_callback = tracing.traced_callback("callback.output", output_callback)
+    tool_output_callback = tracing.traced_callback(
+        "callback.tool_output", tool_output_callback
     )
+    api_response_callback = tracing.traced_callback(
+        "callback.api_response", api_response_callback
+    )
+    if turn_callback is not None:
+        turn_callback = tracing.traced_callback("callback.turn", turn_callback)
     system = BetaTextBlockParam(
         type="text",
         text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
     )
 
-    while True:
-        enable_prompt_caching = False
-        betas = [COMPUTER_USE_BETA_FLAG]
-        image_truncation_threshold = 10
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        if enable_prompt_caching:
-            betas.append(PROMPT_CACHING_BETA_FLAG)
-            _inject_prompt_caching(messages)
-            # Is it ever worth it to bust the cache with prompt caching?
-            image_truncation_threshold = 50
-            system["cache_control"] = {"type": "ephemeral"}
-
-        if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(
-                messages,
-                only_n_most_recent_images,
-                min_removal_threshold=image_truncation_threshold,
-            )
-
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        try:
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=betas,
-            )
-        except (APIStatusError, APIResponseValidationError) as e:
-            api_response_callback(e.request, e.response, e)
-            return messages
-        except APIError as e:
-            api_response_callback(e.request, e.body, e)
-            return messages
-
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
-
-        response = raw_response.parse()
-
-        response_params = _response_to_params(response)
-        messages.append(
-            {
-                "role": "assistant",
-                "content": response_params,
-            }
+    if metrics is None:
+        metrics = SessionMetrics()
+    forget_screenshot = None
+    if screenshot_deduplicator is not None:
+        # never point the model at a screenshot that has been pruned from the history
+        def forget_screenshot(tool_result: BetaToolResultBlockParam):
+            screenshot_deduplicator.forget(tool_result["tool_use_id"])
+
+    image_ledger = ImageLedger(messages, on_remove=forget_screenshot)
+    compactor = ToolResultCompactor(messages)
+    if prompt_caching is None:
+        prompt_caching = provider == APIProvider.ANTHROPIC
+    enable_prompt_caching = prompt_caching
+    cache_planner = CachePlanner()
+    body_builder = RequestBodyBuilder(image_store)
+    tool_params = tool_collection.to_params()
+    prefix_tokens = estimate_text_tokens(system["text"]) + estimate_tools_tokens(
+        tool_params
+    )
+    if warm_up_client:
+        await warm_up(provider, api_key, cassette)
+
+    callbacks = None
+    if callback_queue_size is not None:
+        callbacks = CallbackPipeline(
+            output_callback,
+            tool_output_callback,
+            api_response_callback,
+            max_pending=callback_queue_size,
         )
-
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in response_params:
-            output_callback(content_block)
-            if content_block["type"] == "tool_use":
-                result = await tool_collection.run(
-                    name=content_block["name"],
-                    tool_input=cast(dict[str, Any], content_block["input"]),
+        output_callback = callbacks.output
+        tool_output_callback = callbacks.tool_output
+        api_response_callback = callbacks.api_response
+    try:
+        while True:
+            turn_metrics = metrics.start_turn()
+            turn_deadline = _Deadline(deadline)
+            async with (
+                _reported(turn_metrics, turn_callback),
+                turn_deadline,
+                tracing.span("turn", turn=turn_metrics.turn, model=model) as turn_span,
+            ):
+                if callbacks is not None:
+                    # tool results and their screenshots mustn't pile up behind
+                    # a slow UI
+                    await callbacks.wait_for_room()
+                turn_start = time.perf_counter()
+                betas = [COMPUTER_USE_BETA_FLAG]
+                image_truncation_threshold = 10
+                client = get_client(provider, api_key, cassette)
+
+                if enable_prompt_caching:
+                    betas.append(PROMPT_CACHING_BETA_FLAG)
+                    # Is it ever worth it to bust the cache with prompt caching?
+                    image_truncation_threshold = 50
+                    system["cache_control"] = {"type": "ephemeral"}
+
+                if only_n_most_recent_images:
+                    image_ledger.prune(
+                        only_n_most_recent_images,
+                        min_removal_threshold=image_truncation_threshold,
+                    )
+
+                if compact_tool_results_after is not None:
+                    turn_metrics.compacted_chars = compactor.compact(
+                        compact_tool_results_after, chunk_turns=compaction_chunk_turns
+                    )
+
+                if max_request_tokens is not None or max_request_bytes is not None:
+                    # trim before sending rather than have the API reject the request
+                    turn_metrics.trimmed_images, turn_metrics.trimmed_messages = (
+                        trim_to_budget(
+                            messages,
+                            image_ledger,
+                            estimate_request(system["text"], tool_params, messages),
+                            max_tokens=max_request_tokens,
+                            max_bytes=max_request_bytes,
+                        )
+                    )
+
+                if enable_prompt_caching:
+                    # plan after pruning, so the estimates match what is actually sent
+                    cache_planner.inject(messages, prefix_tokens=prefix_tokens)
+
+                encoded_body = None
+                request_messages = messages
+                if isinstance(client, EncodedBodyClient):
+                    # only messages changed since the last request are encoded
+                    with tracing.span("request.encode") as encode_span:
+                        encoded_body = body_builder.build(
+                            messages,
+                            max_tokens=max_tokens,
+                            model=model,
+                            system=[system],
+                            tools=tool_params,
+                            stream=stream,
+                        )
+                        encode_span.set_attributes(
+                            encoded_messages=body_builder.encoded_messages,
+                            reused_messages=body_builder.reused_messages,
+                            bytes=len(encoded_body.data),
+                        )
+                    turn_metrics.encoded_messages = body_builder.encoded_messages
+                elif image_store is not None:
+                    with tracing.span("images.materialize"):
+                        request_messages = materialize(messages, image_store)
+
+                # Call the API
+                # we use raw_response to provide debug information to streamlit. Your
+                # implementation may be able call the SDK directly with:
+                # `response = await client.messages.create(...)` instead.
+                # The async client yields to the event loop while waiting on the model,
+                # so several sessions can share one loop; cancelling the task aborts
+                # the request.
+                request_start = time.perf_counter()
+                turn_metrics.setup_seconds = request_start - turn_start
+                # tool_use blocks dispatched while the response is still streaming
+                tool_runs: dict[str, asyncio.Task[ToolResult]] = {}
+
+                # text already shown can't be taken back either, see the retry
+                streamed_text = False
+
+                def stream_text(text: str):
+                    nonlocal streamed_text
+                    streamed_text = True
+                    output_callback({"type": "text", "text": text})
+
+                def dispatch_tool_use(content_block: BetaToolUseBlockParam):
+                    output_callback(content_block)
+                    # start the tool right away, the collection orders conflicting calls
+                    tool_runs[content_block["id"]] = _submit_tool_use(
+                        tool_collection, content_block
+                    )
+
+                estimated_tokens = 0
+                if rate_limiter is not None and rate_limiter.tracks_tokens:
+                    estimated_tokens = estimate_request(
+                        system["text"], tool_params, messages
+                    ).tokens
+
+                attempt = 0
+                while True:
+                    if rate_limiter is not None:
+                        wait_start = time.perf_counter()
+                        with tracing.span(
+                            "rate_limit.acquire", tokens=estimated_tokens
+                        ):
+                            await rate_limiter.acquire(
+                                estimated_tokens, priority=priority
+                            )
+                        turn_metrics.rate_limit_wait_seconds += (
+                            time.perf_counter() - wait_start
+                        )
+                    try:
+                        with tracing.span(
+                            "api.messages.create",
+                            attempt=attempt,
+                            stream=stream,
+                            messages=len(messages),
+                        ):
+                            # a retry resends the same request, breakpoints included
+                            if encoded_body is not None:
+                                raw_response = await post_message(
+                                    client, encoded_body, betas=betas, stream=stream
+                                )
+                            else:
+                                raw_response = (
+                                    await client.beta.messages.with_raw_response.create(
+                                        max_tokens=max_tokens,
+                                        messages=request_messages,
+                                        model=model,
+                                        system=[system],
+                                        tools=tool_params,
+                                        betas=betas,
+                                        stream=stream,
+                                    )
+                                )
+                            if stream:
+                                response = await _stream_message(
+                                    raw_response.parse(),
+                                    on_text=stream_text,
+                                    on_tool_use=dispatch_tool_use,
+                                )
+                                # the streamed body is consumed, pass the message
+                                api_response_callback(
+                                    raw_response.http_response.request, response, None
+                                )
+                        break
+                    except APIError as e:
+                        # tools that already started and text already shown can't
+                        # be taken back, don't retry
+                        if (
+                            retry_policy is not None
+                            and not tool_runs
+                            and not streamed_text
+                            and retry_policy.should_retry(e, attempt)
+                        ):
+                            delay = retry_policy.delay(e, attempt)
+                            turn_metrics.retries += 1
+                            turn_metrics.retry_wait_seconds += delay
+                            await asyncio.sleep(delay)
+                            attempt += 1
+                            continue
+                        await _cancel_tool_runs(tool_runs)
+                        if isinstance(e, APIStatusError | APIResponseValidationError):
+                            api_response_callback(e.request, e.response, e)
+                        else:
+                            api_response_callback(e.request, e.body, e)
+                        return messages
+                    except asyncio.CancelledError:
+                        # tools started by the stream must not outlive the request
+                        await _cancel_tool_runs(tool_runs)
+                        raise
+                    finally:
+                        turn_metrics.api_seconds = time.perf_counter() - request_start
+
+                if not stream:
+                    api_response_callback(
+                        raw_response.http_response.request,
+                        raw_response.http_response,
+                        None,
+                    )
+                    response = raw_response.parse()
+
+                turn_metrics.record_usage(response.usage)
+                turn_span.set_attributes(
+                    input_tokens=response.usage.input_tokens,
+                    output_tokens=response.usage.output_tokens,
+                    cache_read_input_tokens=response.usage.cache_read_input_tokens,
+                    stop_reason=response.stop_reason,
                 )
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block["id"])
+                if rate_limiter is not None:
+                    rate_limiter.record(
+                        estimated_tokens,
+                        response.usage.input_tokens
+                        + (response.usage.cache_creation_input_tokens or 0),
+                    )
+                if enable_prompt_caching:
+                    cache_planner.record_usage(response.usage)
+
+                response_params = _response_to_params(response)
+                messages.append(
+                    {
+                        "role": "assistant",
+                        "content": response_params,
+                    }
                 )
-                tool_output_callback(result, content_block["id"])
-
-        if not tool_result_content:
-            return messages
-
-        messages.append({"content": tool_result_content, "role": "user"})
+                compactor.add_message(messages[-1])
+
+                if not stream:
+                    for content_block in response_params:
+                        output_callback(content_block)
+                        if content_block["type"] == "tool_use":
+                            tool_runs[content_block["id"]] = _submit_tool_use(
+                                tool_collection, content_block
+                            )
+
+                # independent tools run concurrently, results are in response order
+                tool_result_content: list[BetaToolResultBlockParam] = []
+                try:
+                    for content_block in response_params:
+                        if content_block["type"] == "tool_use":
+                            result = await tool_runs[content_block["id"]]
+                            turn_metrics.tool_seconds[content_block["id"]] = (
+                                tool_collection.durations.pop(content_block["id"], 0.0)
+                            )
+                            tool_result_content.append(
+                                _make_api_tool_result(
+                                    result,
+                                    content_block["id"],
+                                    screenshot_deduplicator,
+                                    image_store,
+                                )
+                            )
+                            tool_output_callback(result, content_block["id"])
+                            if callbacks is not None:
+                                await callbacks.wait_for_room()
+                except asyncio.CancelledError:
+                    await _cancel_tool_runs(tool_runs)
+                    # tools that ran next to the cancelled ones keep their results
+                    for tool_use_id, result in _finished_tool_runs(
+                        response_params, tool_result_content, tool_runs
+                    ):
+                        tool_result_content.append(
+                            _make_api_tool_result(
+                                result,
+                                tool_use_id,
+                                screenshot_deduplicator,
+                                image_store,
+                            )
+                        )
+                        tool_output_callback(result, tool_use_id)
+                    # every tool_use needs a result for the history to be resumable
+                    tool_result_content = _complete_tool_results(
+                        response_params, tool_result_content
+                    )
+                    messages.append({"content": tool_result_content, "role": "user"})
+                    raise
+                finally:
+                    await _cancel_tool_runs(tool_runs)
+
+                if not tool_result_content:
+                    return messages
+
+                messages.append({"content": tool_result_content, "role": "user"})
+                image_ledger.add_message(messages[-1])
+                compactor.add_message(messages[-1])
+
+                if max_turns is not None and len(metrics.turns) >= max_turns:
+                    # the history ends on the tool results, ready to be resumed
+                    return messages
+
+            if turn_deadline.expired:
+                metrics.deadline_reached = True
+                return messages
+    finally:
+        if callbacks is not None:
+            # the UI must show everything before the loop returns
+            await callbacks.aclose()
 
 
 def _maybe_filter_to_n_most_recent_images(
@@ -195,43 +550,13 @@ def _maybe_filter_to_n_most_recent_images(
     the conversation progresses, remove all but the final `images_to_keep` tool_result
     images in place, with a chunk of min_removal_threshold to reduce the amount we
     break the implicit prompt cache.
+
+    This scans the whole history; the sampling loop keeps an `ImageLedger` instead.
     """
     if images_to_keep is None:
         return messages
 
-    tool_result_blocks = cast(
-        list[BetaToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
-            )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
-
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
-
-    images_to_remove = total_images - images_to_keep
-    # for better cache behavior, we want to remove in chunks
-    images_to_remove -= images_to_remove % min_removal_threshold
-
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
+    ImageLedger(messages).prune(images_to_keep, min_removal_threshold)
 
 
 def _response_to_params(
@@ -246,34 +571,172 @@ def _response_to_params(
     return res
 
 
-def _inject_prompt_caching(
-    messages: list[BetaMessageParam],
-):
+async def _stream_message(
+    stream: AsyncStream[BetaRawMessageStreamEvent],
+    on_text: Callable[[str], None],
+    on_tool_use: Callable[[BetaToolUseBlockParam], None],
+) -> BetaMessage:
     """
-    Set cache breakpoints for the 3 most recent turns
-    one cache breakpoint is left for tools/system prompt, to be shared across sessions
+    Assemble a BetaMessage from a response stream, reporting text deltas as they
+    arrive and each tool_use block as soon as its input JSON is complete.
     """
+    message: BetaMessage | None = None
+    partial_json: dict[int, list[str]] = {}
+    async for event in stream:
+        if event.type == "message_start":
+            message = event.message
+            message.content = []
+        elif message is None:
+            raise APIResponseValidationError(
+                response=stream.response,
+                body=None,
+                message=f"Unexpected {event.type} event before message_start",
+            )
+        elif event.type == "content_block_start":
+            message.content.append(event.content_block)
+            partial_json[event.index] = []
+        elif event.type == "content_block_delta":
+            block = message.content[event.index]
+            if event.delta.type == "text_delta" and isinstance(block, BetaTextBlock):
+                block.text += event.delta.text
+                on_text(event.delta.text)
+            elif event.delta.type == "input_json_delta":
+                partial_json[event.index].append(event.delta.partial_json)
+        elif event.type == "content_block_stop":
+            block = message.content[event.index]
+            if isinstance(block, BetaToolUseBlock):
+                if input_json := "".join(partial_json[event.index]):
+                    try:
+                        block.input = json.loads(input_json)
+                    except ValueError as e:
+                        # e.g. cut off by max_tokens
+                        raise APIResponseValidationError(
+                            response=stream.response,
+                            body=input_json,
+                            message=f"Incomplete input for tool_use {block.id}: {e}",
+                        ) from e
+                on_tool_use(cast(BetaToolUseBlockParam, block.model_dump()))
+        elif event.type == "message_delta":
+            message.stop_reason = event.delta.stop_reason
+            message.stop_sequence = event.delta.stop_sequence
+            message.usage.output_tokens = event.usage.output_tokens
+    if message is None:
+        raise APIResponseValidationError(
+            response=stream.response, body=None, message="Empty response stream"
+        )
+    return message
 
-    breakpoints_remaining = 3
-    for message in reversed(messages):
-        if message["role"] == "user" and isinstance(
-            content := message["content"], list
-        ):
-            if breakpoints_remaining:
-                breakpoints_remaining -= 1
-                content[-1]["cache_control"] = BetaCacheControlEphemeralParam(
-                    {"type": "ephemeral"}
-                )
-            else:
-                content[-1].pop("cache_control", None)
-                # we'll only every have one extra turn per loop
-                break
+
+def _submit_tool_use(
+    tool_collection: ToolCollection, content_block: BetaToolUseBlockParam
+) -> "asyncio.Task[ToolResult]":
+    return tool_collection.submit(
+        name=content_block["name"],
+        tool_input=cast(dict[str, Any], content_block["input"]),
+        call_id=content_block["id"],
+    )
+
+
+async def _cancel_tool_runs(tool_runs: dict[str, "asyncio.Task[ToolResult]"]):
+    """Cancel the tool calls still running and give them time to clean up."""
+    pending = [task for task in tool_runs.values() if not task.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending, timeout=TOOL_CANCEL_GRACE_SECONDS)
+
+
+def _finished_tool_runs(
+    response_params: list[BetaContentBlockParam],
+    tool_result_content: list[BetaToolResultBlockParam],
+    tool_runs: dict[str, "asyncio.Task[ToolResult]"],
+) -> list[tuple[str, ToolResult]]:
+    """The results of tool calls that finished, but weren't collected yet."""
+    collected = {result["tool_use_id"] for result in tool_result_content}
+    finished: list[tuple[str, ToolResult]] = []
+    for content_block in response_params:
+        if content_block["type"] != "tool_use" or content_block["id"] in collected:
+            continue
+        task = tool_runs.get(content_block["id"])
+        if task is None or not task.done() or task.cancelled():
+            continue
+        if (exc := task.exception()) is not None:
+            finished.append(
+                (content_block["id"], ToolFailure(error=f"{type(exc).__name__}: {exc}"))
+            )
+        else:
+            finished.append((content_block["id"], task.result()))
+    return finished
+
+
+def _complete_tool_results(
+    response_params: list[BetaContentBlockParam],
+    tool_result_content: list[BetaToolResultBlockParam],
+) -> list[BetaToolResultBlockParam]:
+    """
+    Add an error result for every tool_use that has none, the ones cancelled
+    before they finished, in response order.
+    """
+    results = {result["tool_use_id"]: result for result in tool_result_content}
+    return [
+        results.get(content_block["id"])
+        or {
+            "type": "tool_result",
+            "tool_use_id": content_block["id"],
+            "content": [{"type": "text", "text": TOOL_CANCELLED_TEXT}],
+            "is_error": True,
+        }
+        for content_block in response_params
+        if content_block["type"] == "tool_use"
+    ]
+
+
+@asynccontextmanager
+async def _reported(
+    turn_metrics: TurnMetrics, turn_callback: Callable[[TurnMetrics], None] | None
+) -> AsyncIterator[None]:
+    try:
+        yield
+    finally:
+        if turn_callback is not None:
+            turn_callback(turn_metrics)
+
+
+class _Deadline:
+    """
+    `asyncio.timeout_at` that swallows its own expiry and records it in
+    `expired`, instead of raising TimeoutError.
+    """
+
+    def __init__(self, when: float | None):
+        self._timeout = asyncio.timeout_at(when)
+        self.expired = False
+
+    async def __aenter__(self) -> "_Deadline":
+        await self._timeout.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback) -> bool | None:
+        try:
+            return await self._timeout.__aexit__(exc_type, exc, traceback)
+        except TimeoutError:
+            if not self._timeout.expired():
+                raise
+            self.expired = True
+            return True
 
 
 def _make_api_tool_result(
-    result: ToolResult, tool_use_id: str
+    result: ToolResult,
+    tool_use_id: str,
+    screenshot_deduplicator: ScreenshotDeduplicator | None = None,
+    image_store: ImageStore | None = None,
 ) -> BetaToolResultBlockParam:
-    """Convert an agent ToolResult to an API ToolResultBlockParam."""
+    """
+    Convert an agent ToolResult to an API ToolResultBlockParam. A screenshot of an
+    unchanged screen is replaced by a note when a deduplicator is given, and the
+    screenshot is put in `image_store` and referred to when one is given.
+    """
     tool_result_content: list[BetaTextBlockParam | BetaImageBlockParam] | str = []
     is_error = False
     if result.error:
@@ -287,7 +750,25 @@ def _make_api_tool_result(
                     "text": _maybe_prepend_system_tool_result(result, result.output),
                 }
             )
-        if result.base64_image:
+        if (
+            result.base64_image
+            and screenshot_deduplicator is not None
+            and (
+                previous_tool_use_id := screenshot_deduplicator.find_duplicate(
+                    result.base64_image, tool_use_id
+                )
+            )
+        ):
+            tool_result_content.append(
+                {
+                    "type": "text",
+                    "text": "Screenshot omitted: the screen is unchanged since "
+                    f"tool_use {previous_tool_use_id}.",
+                }
+            )
+        elif result.base64_image and image_store is not None:
+            tool_result_content.append(image_ref(image_store, result.base64_image))
+        elif result.base64_image:
             tool_result_content.append(
                 {
                     "type": "image",
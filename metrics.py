@@ -0,0 +1,83 @@
+"""
+Lightweight timing and usage counters collected by the sampling loop.
+"""
+
+from dataclasses import dataclass, field
+
+from anthropic.types.beta import BetaUsage
+
+
+@dataclass
+class TurnMetrics:
+    """Timings and usage recorded for a single turn of the sampling loop."""
+
+    turn: int
+    # time spent acquiring a client and preparing the request, before it is sent
+    setup_seconds: float = 0.0
+    # time spent waiting on the API, retries included
+    api_seconds: float = 0.0
+    # failed requests retried, and the time spent backing off between them
+    retries: int = 0
+    retry_wait_seconds: float = 0.0
+    # time spent waiting on a shared rate limiter before sending
+    rate_limit_wait_seconds: float = 0.0
+    # time each tool call of the turn spent running, by tool_use id
+    tool_seconds: dict[str, float] = field(default_factory=dict)
+    # usage reported by the API for the turn's request
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    # history trimmed to fit the per-request budget
+    trimmed_images: int = 0
+    trimmed_messages: int = 0
+    # characters of old tool output replaced with stubs
+    compacted_chars: int = 0
+    # messages encoded for the request body, the others were reused from the last one
+    encoded_messages: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return (
+            self.input_tokens
+            + self.output_tokens
+            + self.cache_creation_input_tokens
+            + self.cache_read_input_tokens
+        )
+
+    def record_usage(self, usage: BetaUsage):
+        self.input_tokens = usage.input_tokens
+        self.output_tokens = usage.output_tokens
+        self.cache_creation_input_tokens = usage.cache_creation_input_tokens or 0
+        self.cache_read_input_tokens = usage.cache_read_input_tokens or 0
+
+
+@dataclass
+class SessionMetrics:
+    """Metrics for a single call to `sampling_loop`, one entry per turn."""
+
+    turns: list[TurnMetrics] = field(default_factory=list)
+    # whether the loop stopped because its deadline passed
+    deadline_reached: bool = False
+
+    def start_turn(self) -> TurnMetrics:
+        turn = TurnMetrics(turn=len(self.turns))
+        self.turns.append(turn)
+        return turn
+
+    @property
+    def total_setup_seconds(self) -> float:
+        return sum(turn.setup_seconds for turn in self.turns)
+
+    @property
+    def mean_setup_seconds(self) -> float:
+        return self.total_setup_seconds / len(self.turns) if self.turns else 0.0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """Share of the session's input tokens that were read from the prompt cache."""
+        cache_read = sum(turn.cache_read_input_tokens for turn in self.turns)
+        total = cache_read + sum(
+            turn.input_tokens + turn.cache_creation_input_tokens for turn in self.turns
+        )
+        return cache_read / total if total else 0.0
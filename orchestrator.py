@@ -0,0 +1,118 @@
+"""
+Runs many sampling loop sessions concurrently on one event loop.
+"""
+
+import asyncio
+import time
+from typing import Any
+
+from anthropic.types.beta import BetaMessageParam
+
+from .loop import sampling_loop
+from .metrics import SessionMetrics
+from .rate_limit import RateLimiter
+
+
+class Orchestrator:
+    """
+    Runs `sampling_loop` sessions concurrently, sharing one `RateLimiter` so that
+    together they stay within the account's requests and tokens per minute.
+
+    Note that each session gets its own tools, but they all drive the same
+    screen; concurrent sessions are meant for tasks that don't depend on it, or
+    for separate displays (see DISPLAY_NUM).
+    """
+
+    def __init__(
+        self,
+        *,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_concurrent_sessions: int | None = None,
+    ):
+        self.rate_limiter = RateLimiter(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+        self._session_slots = (
+            asyncio.Semaphore(max_concurrent_sessions)
+            if max_concurrent_sessions
+            else None
+        )
+        self.session_metrics: list[SessionMetrics] = []
+        self._started: float | None = None
+
+    async def run_session(
+        self,
+        *,
+        priority: int = 0,
+        timeout: float | None = None,
+        **sampling_loop_kwargs: Any,
+    ) -> list[BetaMessageParam]:
+        """
+        Run one session; takes the keyword arguments of `sampling_loop`. A
+        `timeout` in seconds sets its deadline, counted from when the session
+        actually starts rather than from when it was queued.
+        """
+        if self._started is None:
+            self._started = time.monotonic()
+        metrics = sampling_loop_kwargs.pop("metrics", None) or SessionMetrics()
+        self.session_metrics.append(metrics)
+        if self._session_slots is None:
+            return await self._sampling_loop(
+                priority, timeout, metrics, sampling_loop_kwargs
+            )
+        async with self._session_slots:
+            return await self._sampling_loop(
+                priority, timeout, metrics, sampling_loop_kwargs
+            )
+
+    async def run(
+        self, sessions: list[dict[str, Any]]
+    ) -> list[list[BetaMessageParam] | BaseException]:
+        """
+        Run sessions (each a dict of `run_session` keyword arguments) concurrently.
+        Returns each session's messages, or the exception it failed with.
+        """
+        return await asyncio.gather(
+            *(self.run_session(**session) for session in sessions),
+            return_exceptions=True,
+        )
+
+    @property
+    def turns_per_minute(self) -> float:
+        return sum(len(metrics.turns) for metrics in self.session_metrics) / (
+            self._elapsed_minutes()
+        )
+
+    @property
+    def tokens_per_minute(self) -> float:
+        return (
+            sum(
+                turn.total_tokens
+                for metrics in self.session_metrics
+                for turn in metrics.turns
+            )
+            / self._elapsed_minutes()
+        )
+
+    def _elapsed_minutes(self) -> float:
+        if self._started is None:
+            return float("inf")
+        return max(time.monotonic() - self._started, 1e-9) / 60
+
+    async def _sampling_loop(
+        self,
+        priority: int,
+        timeout: float | None,
+        metrics: SessionMetrics,
+        kwargs: dict[str, Any],
+    ) -> list[BetaMessageParam]:
+        if timeout is not None:
+            kwargs = {**kwargs, "deadline": time.monotonic() + timeout}
+        return await sampling_loop(
+            **kwargs,
+            metrics=metrics,
+            rate_limiter=self.rate_limiter,
+            priority=priority,
+        )
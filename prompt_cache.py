@@ -0,0 +1,152 @@
+"""
+Placement of prompt cache breakpoints over the message history.
+"""
+
+from anthropic.types.beta import (
+    BetaCacheControlEphemeralParam,
+    BetaMessageParam,
+    BetaUsage,
+)
+
+from .tokens import estimate_message_tokens
+
+# one of the four breakpoints the API allows is left for tools/system prompt
+MAX_MESSAGE_BREAKPOINTS = 3
+# prefixes shorter than this are never cached by the API (Sonnet/Opus)
+MIN_CACHEABLE_TOKENS = 1024
+# weight of the newest request when updating the estimate calibration
+CALIBRATION_SMOOTHING = 0.3
+
+
+class CachePlanner:
+    """
+    Decides which user turns carry a cache breakpoint, based on estimated prefix
+    sizes, and calibrates those estimates from the usage reported by each response.
+
+    In order of preference a breakpoint goes on:
+    - the newest user turn, written now and read by the next request;
+    - the turn that was newest last time, if its prefix is unchanged, so this
+      request reads what the previous one wrote;
+    - the last turn before the first tool_result image, a prefix that survives
+      pruning of old screenshots;
+    - the most recent remaining turns.
+    Turns whose prefix is too small to be cached, or that add less than
+    `min_cacheable_tokens` over an already chosen breakpoint, are skipped.
+    """
+
+    def __init__(self, min_cacheable_tokens: int = MIN_CACHEABLE_TOKENS):
+        self.min_cacheable_tokens = min_cacheable_tokens
+        # ratio of the API's input token count to our estimate for the same request
+        self.calibration = 1.0
+        self._marked: list[dict] | None = None
+        self._last_tail: tuple[BetaMessageParam, int] | None = None
+        self._last_estimate = 0
+
+    def inject(self, messages: list[BetaMessageParam], prefix_tokens: int = 0):
+        """
+        Set the cache breakpoints of `messages` in place, clearing the ones set
+        for the previous request. `prefix_tokens` estimates tools + system prompt.
+        """
+        candidates: list[tuple[int, int]] = []  # (message index, prefix tokens)
+        first_image_index: int | None = None
+        total = prefix_tokens
+        for index, message in enumerate(messages):
+            total += estimate_message_tokens(message)
+            if message["role"] != "user" or not isinstance(message["content"], list):
+                continue
+            if first_image_index is None and _has_image(message):
+                first_image_index = index
+            candidates.append((index, total))
+        self._last_estimate = total
+
+        chosen = self._choose(messages, candidates, first_image_index)
+
+        if self._marked is None:
+            # breakpoints left over from an earlier session over the same history
+            self._marked = [
+                message["content"][-1]
+                for message in messages
+                if message["role"] == "user"
+                and isinstance(message["content"], list)
+                and message["content"]
+            ]
+        for block in self._marked:
+            block.pop("cache_control", None)
+        self._marked = []
+        for index in chosen:
+            block = messages[index]["content"][-1]
+            block["cache_control"] = BetaCacheControlEphemeralParam(
+                {"type": "ephemeral"}
+            )
+            self._marked.append(block)
+        if candidates:
+            tail_index, tail_tokens = candidates[-1]
+            self._last_tail = (messages[tail_index], tail_tokens)
+
+    def record_usage(self, usage: BetaUsage):
+        """Calibrate the estimates against the usage reported for the last request."""
+        if self._last_estimate:
+            observed = (
+                (usage.cache_read_input_tokens or 0)
+                + (usage.cache_creation_input_tokens or 0)
+                + usage.input_tokens
+            ) / self._last_estimate
+            self.calibration += CALIBRATION_SMOOTHING * (observed - self.calibration)
+
+    def _choose(
+        self,
+        messages: list[BetaMessageParam],
+        candidates: list[tuple[int, int]],
+        first_image_index: int | None,
+    ) -> list[int]:
+        def tokens(prefix_estimate: int) -> float:
+            return prefix_estimate * self.calibration
+
+        preferred: list[tuple[int, int]] = []
+        if candidates:
+            preferred.append(candidates[-1])
+        if self._last_tail is not None:
+            last_message, last_tokens = self._last_tail
+            for index, prefix in candidates:
+                # identity, not equality: the same turn, with an unchanged prefix
+                if messages[index] is last_message and prefix == last_tokens:
+                    preferred.append((index, prefix))
+                    break
+        if first_image_index is not None:
+            stable = [c for c in candidates if c[0] < first_image_index]
+            if stable:
+                preferred.append(stable[-1])
+        preferred.extend(reversed(candidates))
+
+        chosen: list[tuple[int, int]] = []
+        for index, prefix in preferred:
+            if len(chosen) == MAX_MESSAGE_BREAKPOINTS:
+                break
+            if tokens(prefix) < self.min_cacheable_tokens:
+                continue
+            if any(
+                index == other
+                or abs(tokens(prefix) - tokens(other_prefix))
+                < self.min_cacheable_tokens
+                for other, other_prefix in chosen
+            ):
+                continue
+            chosen.append((index, prefix))
+        return sorted(index for index, _ in chosen)
+
+
+def _has_image(message: BetaMessageParam) -> bool:
+    for block in message["content"]:
+        if not isinstance(block, dict):
+            continue
+        if block.get("type") == "image":
+            return True
+        if block.get("type") == "tool_result" and isinstance(
+            content := block.get("content"), list
+        ):
+            if any(
+                isinstance(item, dict) and item.get("type") == "image"
+                for item in content
+            ):
+                return True
+    return False
@@ -0,0 +1,105 @@
+"""
+Client-side rate limiting shared by concurrent sampling loop sessions.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+
+
+class _TokenBucket:
+    """A bucket holding up to one minute's worth of `per_minute` units."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self._rate = per_minute / 60
+        self._updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` (capped at the capacity) is available."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self._rate)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    tokens: int = field(compare=False)
+    wakeup: asyncio.Future = field(compare=False)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and input-tokens-per-minute token buckets shared by
+    several sessions. Waiting requests are granted one at a time, lowest
+    `priority` value first and first come, first served within a priority, so a
+    busy session can't starve the others.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ):
+        self._requests = (
+            _TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self._tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._waiters: list[_Waiter] = []
+        self._sequence = itertools.count()
+
+    @property
+    def tracks_tokens(self) -> bool:
+        return self._tokens is not None
+
+    async def acquire(self, tokens: int = 0, priority: int = 0):
+        """Wait until a request estimated at `tokens` input tokens may be sent."""
+        waiter = _Waiter(
+            priority,
+            next(self._sequence),
+            tokens,
+            asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(self._waiters, waiter)
+        try:
+            while True:
+                if self._waiters[0] is not waiter:
+                    await waiter.wakeup
+                    waiter.wakeup = asyncio.get_running_loop().create_future()
+                    continue
+                if (delay := self._delay(tokens)) <= 0:
+                    break
+                await asyncio.sleep(delay)
+        finally:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            if self._waiters and not self._waiters[0].wakeup.done():
+                self._waiters[0].wakeup.set_result(None)
+        if self._requests is not None:
+            self._requests.level -= 1
+        if self._tokens is not None:
+            self._tokens.level -= tokens
+
+    def record(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once the API reported the actual usage."""
+        if self._tokens is not None:
+            self._tokens.level -= actual_tokens - estimated_tokens
+
+    def _delay(self, tokens: int) -> float:
+        delay = 0.0
+        if self._requests is not None:
+            self._requests.refill()
+            delay = max(delay, self._requests.delay(1))
+        if self._tokens is not None:
+            self._tokens.refill()
+            delay = max(delay, self._tokens.delay(tokens))
+        return delay
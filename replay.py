@@ -0,0 +1,275 @@
+"""
+Records API exchanges to disk and serves them back, to run sessions offline.
+
+A `Cassette` is plugged into the http client of the API client (see
+`clients.get_client`). In "record" mode every request is forwarded and its
+response stored; in "replay" mode responses are served from disk without any
+network access or delay.
+"""
+
+import base64
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Any, Literal
+
+import httpx
+
+# response headers that no longer apply once the body is stored decoded
+_DROPPED_HEADERS = frozenset(
+    {"content-encoding", "content-length", "transfer-encoding"}
+)
+# messages endpoints of the Anthropic, Bedrock and Vertex APIs
+_MESSAGE_PATH_SUFFIXES = (
+    "/messages",
+    "/invoke",
+    "/invoke-with-response-stream",
+    ":rawPredict",
+    ":streamRawPredict",
+)
+# response content types stored as readable text, all others as base64
+_TEXT_CONTENT_TYPES = ("text/", "application/json")
+# the date in the system prompt, which would tie recordings to the day
+_DATE_LINE = re.compile(r"^\* The current date is .*$", re.MULTILINE)
+
+
+def fingerprint(request: httpx.Request, *, match_tool_results: bool = True) -> str:
+    """
+    Canonical hash of a messages request: its path, model, system, tools,
+    messages and whether it streams. Image data is replaced by its hash and
+    cache_control markers are ignored, so recordings replay with or without
+    prompt caching. With `match_tool_results=False` the contents of tool
+    results are ignored too, for tools whose output differs between runs.
+    The current date is left out of the system prompt, so recordings replay on
+    other days.
+    """
+    try:
+        body = json.loads(request.content)
+    except ValueError:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+    key = {
+        "method": request.method,
+        "path": request.url.path,
+        "model": body.get("model"),
+        "system": _without_date(body.get("system")),
+        "tools": body.get("tools"),
+        "messages": body.get("messages"),
+        "stream": bool(body.get("stream")),
+    }
+    canonical = json.dumps(
+        _canonicalize(key, match_tool_results),
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _without_date(system: Any) -> Any:
+    if isinstance(system, str):
+        return _DATE_LINE.sub("", system)
+    if isinstance(system, list):
+        return [
+            (
+                {**block, "text": _DATE_LINE.sub("", block["text"])}
+                if isinstance(block, dict) and isinstance(block.get("text"), str)
+                else block
+            )
+            for block in system
+        ]
+    return system
+
+
+def _canonicalize(value: Any, match_tool_results: bool) -> Any:
+    if isinstance(value, list):
+        return [_canonicalize(item, match_tool_results) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if value.get("type") == "base64" and isinstance(value.get("data"), str):
+        return {
+            **value,
+            "data": "sha256:" + hashlib.sha256(value["data"].encode()).hexdigest(),
+        }
+    if value.get("type") == "tool_result" and not match_tool_results:
+        value = {k: v for k, v in value.items() if k not in ("content", "is_error")}
+    return {
+        k: _canonicalize(v, match_tool_results)
+        for k, v in value.items()
+        if k != "cache_control"
+    }
+
+
+class Cassette:
+    """
+    A directory of recorded exchanges, one `<fingerprint>.json` file per
+    distinct request. Identical requests sent more than once (e.g. retried after
+    an overloaded error) are recorded in order and replayed in the same order,
+    the last response repeating.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        mode: Literal["record", "replay"],
+        *,
+        match_tool_results: bool = True,
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.directory = Path(directory)
+        self.mode = mode
+        self.match_tool_results = match_tool_results
+        self.hits = 0
+        self.misses = 0
+        # responses served so far per fingerprint, in replay mode
+        self._served: dict[str, int] = {}
+        if mode == "record":
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def transport(
+        self, wrapped: httpx.AsyncBaseTransport | None
+    ) -> httpx.AsyncBaseTransport:
+        """
+        The transport to build the http client with. When recording, `wrapped`
+        does the actual I/O; it is unused when replaying.
+        """
+        if self.mode == "record" and wrapped is None:
+            raise ValueError("Recording needs a transport to forward requests to")
+        return _CassetteTransport(self, wrapped if self.mode == "record" else None)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _record(self, key: str, request: httpx.Request, response: httpx.Response):
+        path = self._path(key)
+        entry = (
+            json.loads(path.read_text())
+            if path.exists()
+            else {
+                "request": {
+                    "method": request.method,
+                    "url": str(request.url),
+                    "body": _canonicalize(
+                        _json_or_none(request.content), self.match_tool_results
+                    ),
+                },
+                "responses": [],
+            }
+        )
+        entry["responses"].append(
+            {
+                "status_code": response.status_code,
+                "headers": [
+                    (name, value)
+                    for name, value in response.headers.items()
+                    if name.lower() not in _DROPPED_HEADERS
+                ],
+                **_stored_content(response),
+            }
+        )
+        path.write_text(json.dumps(entry, ensure_ascii=False))
+
+    def _replay(self, key: str, request: httpx.Request) -> httpx.Response:
+        path = self._path(key)
+        if not path.exists():
+            self.misses += 1
+            # a 404 surfaces as an APIStatusError that the retry policy gives up on
+            return httpx.Response(
+                404,
+                json={
+                    "type": "error",
+                    "error": {
+                        "type": "not_found_error",
+                        "message": f"No recorded response for request {key}",
+                    },
+                },
+                request=request,
+            )
+        self.hits += 1
+        responses = json.loads(path.read_text())["responses"]
+        served = self._served.get(key, 0)
+        self._served[key] = served + 1
+        recorded = responses[min(served, len(responses) - 1)]
+        return httpx.Response(
+            recorded["status_code"],
+            headers=recorded["headers"],
+            content=_recorded_content(recorded),
+            request=request,
+        )
+
+
+def _json_or_none(content: bytes) -> Any:
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+def _stored_content(response: httpx.Response) -> dict[str, str]:
+    """
+    The body of `response` as it is stored: text as is, anything else (like the
+    eventstream of Bedrock, or text that isn't UTF-8) as base64.
+    """
+    content_type = response.headers.get("content-type", "")
+    if content_type.startswith(_TEXT_CONTENT_TYPES):
+        try:
+            return {"content": response.content.decode("utf-8")}
+        except UnicodeDecodeError:
+            pass
+    return {
+        "content": base64.b64encode(response.content).decode("ascii"),
+        "content_encoding": "base64",
+    }
+
+
+def _recorded_content(recorded: dict[str, Any]) -> bytes:
+    if recorded.get("content_encoding") == "base64":
+        return base64.b64decode(recorded["content"])
+    return recorded["content"].encode()
+
+
+class _CassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, wrapped: httpx.AsyncBaseTransport | None):
+        self._cassette = cassette
+        self._wrapped = wrapped
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        is_message = request.method == "POST" and request.url.path.endswith(
+            _MESSAGE_PATH_SUFFIXES
+        )
+        if self._wrapped is None:
+            if not is_message:
+                # e.g. the warm up request, nothing to serve
+                return httpx.Response(404, request=request)
+            return self._cassette._replay(self._key(request), request)
+
+        response = await self._wrapped.handle_async_request(request)
+        if not is_message:
+            return response
+        # the whole body is read before it is returned, so recording doesn't stream
+        content = await response.aread()
+        await response.aclose()
+        response = httpx.Response(
+            response.status_code,
+            headers=[
+                (name, value)
+                for name, value in response.headers.items()
+                if name.lower() not in _DROPPED_HEADERS
+            ],
+            content=content,
+            request=request,
+        )
+        self._cassette._record(self._key(request), request, response)
+        return response
+
+    def _key(self, request: httpx.Request) -> str:
+        return fingerprint(
+            request, match_tool_results=self._cassette.match_tool_results
+        )
+
+    async def aclose(self):
+        if self._wrapped is not None:
+            await self._wrapped.aclose()
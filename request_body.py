@@ -0,0 +1,162 @@
+"""
+Incremental encoding of Messages API request bodies.
+
+Most of a request is the message history, and most of the history is the same
+from one turn to the next; only new messages, and the few that image pruning,
+compaction or moved cache breakpoints touched, need encoding again.
+"""
+
+import inspect
+import json
+from collections.abc import Hashable
+from typing import Any
+
+import httpx
+from anthropic import AsyncAnthropic, AsyncStream
+from anthropic.types.beta import (
+    BetaMessage,
+    BetaMessageParam,
+    BetaRawMessageStreamEvent,
+)
+
+from .images import ImageStore, materialize
+
+# `EncodedBodyClient` builds on SDK internals, known to hold for the versions
+# allowed by requirements.txt; without them requests are encoded by the SDK
+try:
+    from anthropic._base_client import FinalRequestOptions
+    from anthropic._constants import DEFAULT_TIMEOUT, RAW_RESPONSE_HEADER
+    from anthropic._legacy_response import LegacyAPIResponse
+
+    ENCODED_BODIES_SUPPORTED = (
+        "retries_taken" in inspect.signature(AsyncAnthropic._build_request).parameters
+    )
+except ImportError:
+    ENCODED_BODIES_SUPPORTED = False
+
+
+class EncodedBody:
+    """A JSON request body encoded ahead of time, see `EncodedBodyClient`."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class EncodedBodyClient(AsyncAnthropic):
+    """An AsyncAnthropic client that also sends an `EncodedBody` as it is."""
+
+    def _build_request(
+        self, options: "FinalRequestOptions", *, retries_taken: int = 0
+    ) -> httpx.Request:
+        body = options.json_data
+        if not isinstance(body, EncodedBody):
+            return super()._build_request(options, retries_taken=retries_taken)
+        request = super()._build_request(
+            options.model_copy(update={"json_data": None}),
+            retries_taken=retries_taken,
+        )
+        headers = request.headers.copy()
+        # set for the empty body, httpx sets the right one
+        headers.pop("Content-Length", None)
+        return httpx.Request(
+            request.method,
+            request.url,
+            headers=headers,
+            content=body.data,
+            extensions=request.extensions,
+        )
+
+
+async def post_message(
+    client: EncodedBodyClient, body: EncodedBody, *, betas: list[str], stream: bool
+) -> "LegacyAPIResponse[BetaMessage | AsyncStream[BetaRawMessageStreamEvent]]":
+    """`client.beta.messages.with_raw_response.create`, with an encoded body."""
+    return await client.post(
+        "/v1/messages?beta=true",
+        body=body,
+        cast_to=BetaMessage,
+        options={
+            "headers": {"anthropic-beta": ",".join(betas), RAW_RESPONSE_HEADER: "true"},
+            # as `create` does
+            "timeout": 600 if client.timeout == DEFAULT_TIMEOUT else client.timeout,
+        },
+        stream=stream,
+        stream_cls=AsyncStream[BetaRawMessageStreamEvent],
+    )
+
+
+class RequestBodyBuilder:
+    """
+    Encodes request bodies, reusing the encoded JSON of every message that is
+    unchanged since the previous body. Whether a message changed is told from a
+    signature of its blocks (their identity, keys and lengths), which catches
+    the in-place edits the sampling loop makes to its history without encoding
+    anything. With an `image_store`, image references are materialized only for
+    the messages being encoded.
+    """
+
+    def __init__(self, image_store: ImageStore | None = None):
+        self.image_store = image_store
+        # messages encoded for the last body and reused from the one before
+        self.encoded_messages = 0
+        self.reused_messages = 0
+        self._encoded: dict[int, tuple[BetaMessageParam, Hashable, bytes]] = {}
+
+    def build(self, messages: list[BetaMessageParam], **fields: Any) -> EncodedBody:
+        """Encode `{**fields, "messages": messages}`."""
+        encoded: dict[int, tuple[BetaMessageParam, Hashable, bytes]] = {}
+        parts: list[bytes] = []
+        self.encoded_messages = self.reused_messages = 0
+        for message in messages:
+            signature = _message_signature(message)
+            previous = self._encoded.get(id(message))
+            # the entry holds on to the message, so its id can't have been reused
+            if (
+                previous is not None
+                and previous[0] is message
+                and previous[1] == signature
+            ):
+                data = previous[2]
+                self.reused_messages += 1
+            else:
+                sent = message
+                if self.image_store is not None:
+                    (sent,) = materialize([message], self.image_store)
+                data = _encode(sent)
+                self.encoded_messages += 1
+            encoded[id(message)] = (message, signature, data)
+            parts.append(data)
+        self._encoded = encoded
+        head = _encode(fields)
+        return EncodedBody(
+            b'{"messages":['
+            + b",".join(parts)
+            + (b"]," + head[1:] if fields else b"]}")
+        )
+
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def _message_signature(message: BetaMessageParam) -> Hashable:
+    content = message["content"]
+    if isinstance(content, str):
+        return id(content), len(content)
+    return id(content), tuple(map(_block_signature, content))
+
+
+def _block_signature(block: Any) -> Hashable:
+    if not isinstance(block, dict):
+        return id(block)
+    # the number of keys changes with cache breakpoints
+    signature: tuple[Hashable, ...] = (id(block), len(block))
+    if isinstance(text := block.get("text"), str):
+        signature += (id(text), len(text))
+    if isinstance(content := block.get("content"), list):
+        signature += (id(content), tuple(map(_block_signature, content)))
+    elif isinstance(content, str):
+        signature += (id(content), len(content))
+    return signature
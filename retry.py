@@ -0,0 +1,78 @@
+"""
+Retry scheduling for rate limited or overloaded API requests.
+"""
+
+import email.utils
+import random
+import time
+from dataclasses import dataclass
+
+import httpx
+from anthropic import (
+    APIConnectionError,
+    APIError,
+    APIStatusError,
+)
+
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+RETRYABLE_ERROR_TYPES = frozenset({"overloaded_error", "rate_limit_error", "api_error"})
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Jittered exponential backoff, capped at `max_delay`, that honours the
+    `retry-after` headers of the response when present.
+    """
+
+    max_retries: int = 5
+    base_delay: float = 1.0  # seconds
+    max_delay: float = 60.0  # seconds
+
+    def should_retry(self, error: APIError, attempt: int) -> bool:
+        """Whether a request that failed with `error` on `attempt` (from 0) is retried."""
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, APIConnectionError):
+            return True
+        if isinstance(error, APIStatusError):
+            if error.status_code in RETRYABLE_STATUS_CODES:
+                return True
+            # errors raised mid-stream arrive on a 200 response
+            return _error_type(error.body) in RETRYABLE_ERROR_TYPES
+        return False
+
+    def delay(self, error: APIError, attempt: int) -> float:
+        """Seconds to wait before retrying after `error` on `attempt` (from 0)."""
+        if (
+            isinstance(error, APIStatusError)
+            and (retry_after := _retry_after(error.response.headers)) is not None
+        ):
+            return min(retry_after, self.max_delay)
+        backoff = min(self.max_delay, self.base_delay * 2**attempt)
+        # "equal jitter": keep half the backoff, randomize the other half
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+def _retry_after(headers: httpx.Headers) -> float | None:
+    """Parse `retry-after-ms` or `retry-after` (seconds or an HTTP date)."""
+    if retry_after_ms := headers.get("retry-after-ms"):
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    if not (retry_after := headers.get("retry-after")):
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    if (date := email.utils.parsedate_tz(retry_after)) is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+def _error_type(body: object) -> str | None:
+    if isinstance(body, dict) and isinstance(error := body.get("error"), dict):
+        return error.get("type")
+    return None
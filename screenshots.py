@@ -0,0 +1,101 @@
+"""
+Detection of repeated screenshots, so an unchanged screen isn't resent as an image.
+"""
+
+import base64
+import io
+from typing import Literal
+
+from PIL import Image
+
+from .tokens import estimate_image_tokens, image_size
+
+HashType = Literal["dhash", "ahash"]
+
+# hashes are hash_size x hash_size bits; UI changes like a few typed characters
+# are small, so this is much finer than the 8x8 usual for photos
+DEFAULT_HASH_SIZE = 32
+# maximum number of differing bits for two frames to count as the same screen
+DEFAULT_THRESHOLD = 0
+
+
+def perceptual_hash(
+    base64_image: str, hash_type: HashType = "dhash", hash_size: int = DEFAULT_HASH_SIZE
+) -> int:
+    """Compute a difference (dhash) or average (ahash) hash of a base64 image."""
+    image = Image.open(io.BytesIO(base64.b64decode(base64_image))).convert("L")
+    if hash_type == "dhash":
+        pixels = list(
+            image.resize(
+                (hash_size + 1, hash_size), Image.Resampling.BILINEAR
+            ).getdata()
+        )
+        bits = (
+            pixels[row * (hash_size + 1) + col]
+            > pixels[row * (hash_size + 1) + col + 1]
+            for row in range(hash_size)
+            for col in range(hash_size)
+        )
+    elif hash_type == "ahash":
+        pixels = list(
+            image.resize((hash_size, hash_size), Image.Resampling.BILINEAR).getdata()
+        )
+        mean = sum(pixels) / len(pixels)
+        bits = (pixel > mean for pixel in pixels)
+    else:
+        raise ValueError(f"Unknown hash type: {hash_type}")
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bit
+    return value
+
+
+class ScreenshotDeduplicator:
+    """
+    Compares each screenshot with the last one sent to the model and reports
+    when the screen hasn't changed, within `threshold` differing hash bits.
+    Counts how many images (and estimated image tokens) that saved.
+    """
+
+    def __init__(
+        self,
+        threshold: int = DEFAULT_THRESHOLD,
+        hash_type: HashType = "dhash",
+        hash_size: int = DEFAULT_HASH_SIZE,
+    ):
+        self.threshold = threshold
+        self.hash_type = hash_type
+        self.hash_size = hash_size
+        self.deduplicated = 0
+        self.image_tokens_saved = 0
+        self._reference: tuple[str, str, int] | None = None
+
+    def find_duplicate(self, base64_image: str, tool_use_id: str) -> str | None:
+        """
+        Return the tool_use id of the last screenshot sent if this one shows the
+        same screen; otherwise remember this one as the screenshot to compare to.
+        """
+        if self._reference is not None:
+            reference_id, reference_image, reference_hash = self._reference
+            if base64_image == reference_image:
+                return self._count(base64_image, reference_id)
+            image_hash = self._hash(base64_image)
+            if (image_hash ^ reference_hash).bit_count() <= self.threshold:
+                return self._count(base64_image, reference_id)
+        else:
+            image_hash = self._hash(base64_image)
+        self._reference = (tool_use_id, base64_image, image_hash)
+        return None
+
+    def forget(self, tool_use_id: str):
+        """Stop referring to a screenshot that is no longer in the history."""
+        if self._reference is not None and self._reference[0] == tool_use_id:
+            self._reference = None
+
+    def _hash(self, base64_image: str) -> int:
+        return perceptual_hash(base64_image, self.hash_type, self.hash_size)
+
+    def _count(self, base64_image: str, reference_id: str) -> str:
+        self.deduplicated += 1
+        self.image_tokens_saved += estimate_image_tokens(*image_size(base64_image))
+        return reference_id
@@ -22,6 +22,10 @@ from anthropic.types.beta import (
 )
 from streamlit.delta_generator import DeltaGenerator
 
+from computer_use_demo import tracing
+from computer_use_demo.callbacks import DEFAULT_MAX_PENDING
+from computer_use_demo.clients import close_clients
+from computer_use_demo.images import ImageStore
 from computer_use_demo.loop import (
     PROVIDER_TO_DEFAULT_MODEL_NAME,
     APIProvider,
@@ -62,6 +66,8 @@ def setup_state():
         "provider": os.getenv("API_PROVIDER", "anthropic") or APIProvider.ANTHROPIC,
         "responses": {},
         "tools": {},
+        # screenshots of the tool results, by tool_use id, as image store keys
+        "images": {},
         "only_n_most_recent_images": 10,
         "custom_system_prompt": load_from_storage("system_prompt") or "",
         "hide_images": False,
@@ -78,6 +84,8 @@ def setup_state():
         st.session_state.provider_radio = st.session_state.provider
     if "model" not in st.session_state:
         _reset_model()
+    if "image_store" not in st.session_state:
+        st.session_state.image_store = ImageStore()
 
 
 def _reset_model():
@@ -89,6 +97,8 @@ def _reset_model():
 async def main():
     """Render loop for streamlit"""
     setup_state()
+    # a no-op on reruns, the exporter outlives them
+    tracing.configure_from_env()
 
     st.markdown(STREAMLIT_STYLE, unsafe_allow_html=True)
 
@@ -179,7 +189,9 @@ async def main():
                     # so we store the tool use responses
                     if isinstance(block, dict) and block["type"] == "tool_result":
                         _render_message(
-                            Sender.TOOL, st.session_state.tools[block["tool_use_id"]]
+                            Sender.TOOL,
+                            st.session_state.tools[block["tool_use_id"]],
+                            image=_stored_image(block["tool_use_id"]),
                         )
                     else:
                         _render_message(
@@ -219,7 +231,10 @@ async def main():
                 messages=st.session_state.messages,
                 output_callback=partial(_render_message, Sender.BOT),
                 tool_output_callback=partial(
-                    _tool_output_callback, tool_state=st.session_state.tools
+                    _tool_output_callback,
+                    tool_state=st.session_state.tools,
+                    image_state=st.session_state.images,
+                    image_store=st.session_state.image_store,
                 ),
                 api_response_callback=partial(
                     _api_response_callback,
@@ -228,6 +243,9 @@ async def main():
                 ),
                 api_key=st.session_state.api_key,
                 only_n_most_recent_images=st.session_state.only_n_most_recent_images,
+                # rendering happens while the agent waits on the API and tools
+                callback_queue_size=DEFAULT_MAX_PENDING,
+                image_store=st.session_state.image_store,
             )
 
 
@@ -297,11 +315,29 @@ def _api_response_callback(
 
 
 def _tool_output_callback(
-    tool_output: ToolResult, tool_id: str, tool_state: dict[str, ToolResult]
+    tool_output: ToolResult,
+    tool_id: str,
+    tool_state: dict[str, ToolResult],
+    image_state: dict[str, str],
+    image_store: ImageStore,
 ):
-    """Handle a tool output by storing it to state and rendering it."""
+    """
+    Handle a tool output by storing it to state and rendering it. Screenshots
+    are kept in the image store rather than in the stored result.
+    """
+    image = None
+    if tool_output.base64_image:
+        image = base64.b64decode(tool_output.base64_image)
+        image_state[tool_id] = image_store.put(image)
+        tool_output = tool_output.replace(base64_image=None)
     tool_state[tool_id] = tool_output
-    _render_message(Sender.TOOL, tool_output)
+    _render_message(Sender.TOOL, tool_output, image=image)
+
+
+def _stored_image(tool_id: str) -> bytes | None:
+    if (key := st.session_state.images.get(tool_id)) is None:
+        return None
+    return st.session_state.image_store.get(key)
 
 
 def _render_api_response(
@@ -346,12 +382,16 @@ def _render_error(error: Exception):
 def _render_message(
     sender: Sender,
     message: str | BetaContentBlockParam | ToolResult,
+    image: bytes | None = None,
 ):
-    """Convert input from the user or output from the agent to a streamlit message."""
+    """
+    Convert input from the user or output from the agent to a streamlit message.
+    A tool result's screenshot can be passed as `image` instead of in the result.
+    """
     # streamlit's hotreloading breaks isinstance checks, so we need to check for class names
     is_tool_result = not isinstance(message, str | dict)
     hide_images = st.session_state.get("hide_images", False)
-    if not message or (
+    if not (message or image) or (
         is_tool_result
         and hide_images
         and not hasattr(message, "error")
@@ -368,8 +408,10 @@ def _render_message(
                     st.markdown(message.output)
             if message.error:
                 st.error(message.error)
-            if message.base64_image and not st.session_state.get("hide_images", False):
-                st.image(base64.b64decode(message.base64_image))
+            if image is None and message.base64_image:
+                image = base64.b64decode(message.base64_image)
+            if image and not st.session_state.get("hide_images", False):
+                st.image(image)
         elif isinstance(message, dict):
             if message["type"] == "text":
                 st.write(message["text"])
@@ -382,5 +424,13 @@ def _render_message(
             st.markdown(message)
 
 
+async def run():
+    try:
+        await main()
+    finally:
+        # every rerun runs on a new event loop, its clients go with it
+        await close_clients()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run())
@@ -0,0 +1,59 @@
+import asyncio
+
+from computer_use_demo import tracing
+from computer_use_demo.callbacks import CallbackPipeline
+from computer_use_demo.tools import ToolResult
+
+
+class CollectingExporter(tracing.SpanExporter):
+    def __init__(self):
+        self.spans: list[tracing.Span] = []
+
+    def export(self, span: tracing.Span):
+        self.spans.append(span)
+
+
+def test_wait_for_room_holds_the_loop_until_the_consumer_catches_up():
+    delivered: list[str] = []
+
+    async def run():
+        pipeline = CallbackPipeline(
+            lambda block: None,
+            lambda result, tool_use_id: delivered.append(tool_use_id),
+            lambda request, response, error: None,
+            max_pending=2,
+        )
+        for i in range(3):
+            pipeline.tool_output(ToolResult(output="x"), str(i))
+        pending = len(pipeline._pending)
+        await pipeline.wait_for_room()
+        assert len(pipeline._pending) < pipeline.max_pending
+        await pipeline.aclose()
+        return pending
+
+    assert asyncio.run(run()) == 3
+    assert delivered == ["0", "1", "2"]
+
+
+def test_callbacks_run_in_the_span_they_were_queued_in():
+    exporter = CollectingExporter()
+    tracing.configure(exporter)
+
+    def output_callback(block):
+        with tracing.span("callback.output"):
+            pass
+
+    async def run():
+        pipeline = CallbackPipeline(
+            output_callback, lambda *args: None, lambda *args: None
+        )
+        with tracing.span("turn"):
+            pipeline.output({"type": "text", "text": "hello"})
+        await pipeline.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        tracing.configure(None)
+    spans = {span.name: span for span in exporter.spans}
+    assert spans["callback.output"].parent_id == spans["turn"].span_id
@@ -0,0 +1,39 @@
+import asyncio
+
+from computer_use_demo import clients
+from computer_use_demo.clients import APIProvider, close_clients, get_client
+
+
+def test_client_is_reused_on_the_same_loop():
+    async def run():
+        try:
+            return get_client(APIProvider.ANTHROPIC, "key"), get_client(
+                APIProvider.ANTHROPIC, "key"
+            )
+        finally:
+            await close_clients()
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert first.is_closed()
+
+
+def test_clients_of_closed_loops_are_evicted():
+    async def first_run():
+        return get_client(APIProvider.ANTHROPIC, "key")
+
+    # left open, as when a loop ends without close_clients
+    stale = asyncio.run(first_run())
+
+    async def second_run():
+        client = get_client(APIProvider.ANTHROPIC, "key")
+        try:
+            assert client is not stale
+            assert [key[0] for key in clients._clients] == [asyncio.get_running_loop()]
+        finally:
+            await close_clients()
+        return client
+
+    client = asyncio.run(second_run())
+    assert client.is_closed()
+    assert not clients._clients
@@ -0,0 +1,123 @@
+import asyncio
+
+from computer_use_demo.tools import BashTool, EditTool, ToolCollection, ToolResult
+from computer_use_demo.tools.base import BaseAnthropicTool
+
+
+class ScreenTool(BaseAnthropicTool):
+    """Records when each call starts and ends, like the computer tool it stands in for."""
+
+    def __init__(self, events: list[str], seconds: float = 0.05):
+        self.events = events
+        self.seconds = seconds
+
+    def to_params(self):
+        return {"name": "computer", "type": "computer_20241022"}
+
+    def resources(self, **kwargs) -> frozenset[str]:
+        return frozenset({"screen"})
+
+    async def __call__(self, *, action: str, **kwargs):
+        self.events.append(f"start {action}")
+        await asyncio.sleep(self.seconds)
+        self.events.append(f"end {action}")
+        return ToolResult(output=action)
+
+
+def test_view_waits_for_earlier_bash_command(tmp_path):
+    path = tmp_path / "f"
+
+    async def run():
+        collection = ToolCollection(BashTool(), EditTool())
+        return await collection.run_many(
+            [
+                ("bash", {"command": f"sleep 0.5; echo hello > {path}"}),
+                ("str_replace_editor", {"command": "view", "path": str(path)}),
+            ]
+        )
+
+    _, view = asyncio.run(run())
+    assert view.error is None
+    assert "hello" in view.output
+
+
+def test_screen_calls_run_in_order():
+    events: list[str] = []
+
+    async def run():
+        collection = ToolCollection(ScreenTool(events))
+        return await collection.run_many(
+            [
+                ("computer", {"action": "left_click"}),
+                ("computer", {"action": "type"}),
+                ("computer", {"action": "screenshot"}),
+            ]
+        )
+
+    results = asyncio.run(run())
+    assert [result.output for result in results] == ["left_click", "type", "screenshot"]
+    assert events == [
+        "start left_click",
+        "end left_click",
+        "start type",
+        "end type",
+        "start screenshot",
+        "end screenshot",
+    ]
+
+
+def test_screen_calls_wait_for_bash_commands_around_them(tmp_path):
+    events: list[str] = []
+    marker = tmp_path / "marker"
+
+    async def run():
+        collection = ToolCollection(BashTool(), ScreenTool(events))
+        return await collection.run_many(
+            [
+                ("computer", {"action": "left_click"}),
+                ("bash", {"command": f"sleep 0.2; touch {marker}"}),
+                ("computer", {"action": "screenshot"}),
+            ]
+        )
+
+    asyncio.run(run())
+    # the screenshot is taken after the command that came before it finished
+    assert events == [
+        "start left_click",
+        "end left_click",
+        "start screenshot",
+        "end screenshot",
+    ]
+    assert marker.exists()
+
+
+def test_editor_calls_on_different_files_run_concurrently(tmp_path):
+    events: list[str] = []
+
+    class FileTool(ScreenTool):
+        def to_params(self):
+            return {"name": "str_replace_editor", "type": "text_editor_20241022"}
+
+        def resources(self, **kwargs) -> frozenset[str]:
+            return EditTool().resources(**kwargs)
+
+        async def __call__(self, *, command: str, path: str, **kwargs):
+            return await super().__call__(action=path)
+
+    async def run():
+        collection = ToolCollection(FileTool(events))
+        return await collection.run_many(
+            [
+                (
+                    "str_replace_editor",
+                    {"command": "view", "path": str(tmp_path / "a")},
+                ),
+                (
+                    "str_replace_editor",
+                    {"command": "view", "path": str(tmp_path / "b")},
+                ),
+            ]
+        )
+
+    asyncio.run(run())
+    assert [event.split()[0] for event in events] == ["start", "start", "end", "end"]
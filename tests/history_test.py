@@ -0,0 +1,41 @@
+from computer_use_demo.history import (
+    COMPACTED_MIN_CHARS,
+    COMPACTED_STUB_LINES,
+    ToolResultCompactor,
+)
+
+
+def _compact(output: str) -> str:
+    messages = [
+        {
+            "role": "assistant",
+            "content": [{"type": "tool_use", "id": "t1", "name": "bash", "input": {}}],
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "tool_result", "tool_use_id": "t1", "content": output}
+            ],
+        },
+    ]
+    ToolResultCompactor(messages).compact(keep_turns=0, chunk_turns=1)
+    return messages[1]["content"][0]["content"]
+
+
+def test_stub_keeps_first_and_last_lines():
+    lines = [f"line {i}" for i in range(500)]
+    stub = _compact("\n".join(lines)).split("\n")
+    assert stub[:COMPACTED_STUB_LINES] == lines[:COMPACTED_STUB_LINES]
+    assert stub[-COMPACTED_STUB_LINES:] == lines[-COMPACTED_STUB_LINES:]
+    assert "<compacted>old tool output of 500 lines" in stub[COMPACTED_STUB_LINES]
+
+
+def test_stub_cuts_long_lines():
+    # e.g. minified JSON, a few lines of a hundred thousand characters
+    lines = [c * 100_000 for c in "abcdefghijkl"]
+    stub = _compact("\n".join(lines))
+    head, note, tail = stub.split("\n")
+    assert head == "a" * (COMPACTED_MIN_CHARS // 2)
+    assert tail == "l" * (COMPACTED_MIN_CHARS // 2)
+    assert "1200011 characters" in note
+    assert len(stub) < 2 * COMPACTED_MIN_CHARS
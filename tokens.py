@@ -0,0 +1,171 @@
+"""
+Offline token and size estimates for requests, good enough for budgeting and for
+deciding where prompt cache breakpoints pay off. These are approximations: the
+API's own counts (see `usage` on each response) remain the source of truth.
+"""
+
+import base64
+import binascii
+import json
+import math
+import struct
+from dataclasses import dataclass
+
+from anthropic.types.beta import BetaMessageParam, BetaToolUnionParam
+
+CHARS_PER_TOKEN = 4
+# the API scales images down so the long edge fits and the area stays below ~1.15MP
+MAX_IMAGE_EDGE_PX = 1568
+MAX_IMAGE_PIXELS = 1_150_000
+PIXELS_PER_TOKEN = 750
+# used when an image's dimensions can't be read from its header
+DEFAULT_IMAGE_SIZE = (1024, 768)
+
+# the API expands Anthropic-defined tools into a fixed-size definition, see
+# https://docs.anthropic.com/en/docs/build-with-claude/computer-use
+ANTHROPIC_TOOL_TOKENS = {
+    "computer_20241022": 683,
+    "text_editor_20241022": 700,
+    "bash_20241022": 245,
+}
+TOOL_USE_SYSTEM_PROMPT_TOKENS = 466
+# JSON keys, quotes and punctuation around each serialized content block
+BLOCK_OVERHEAD_BYTES = 64
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+@dataclass(frozen=True)
+class RequestEstimate:
+    """Estimated size of a request, in input tokens and in bytes of JSON body."""
+
+    tokens: int
+    bytes: int
+
+
+def estimate_text_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def image_size(base64_data: str) -> tuple[int, int]:
+    """Read (width, height) from the header of a base64 PNG, without decoding it all."""
+    # 32 base64 chars decode to the 24 bytes holding the signature and IHDR size
+    try:
+        header = base64.b64decode(base64_data[:32])
+    except binascii.Error:
+        return DEFAULT_IMAGE_SIZE
+    return png_size(header)
+
+
+def png_size(data: bytes) -> tuple[int, int]:
+    """Read (width, height) from the header of PNG bytes."""
+    if len(data) >= 24 and data.startswith(_PNG_SIGNATURE):
+        width, height = struct.unpack(">II", data[16:24])
+        return width, height
+    return DEFAULT_IMAGE_SIZE
+
+
+def base64_length(size: int) -> int:
+    """Length of the base64 encoding of `size` bytes."""
+    return 4 * math.ceil(size / 3)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    scale = min(
+        1.0,
+        MAX_IMAGE_EDGE_PX / max(width, height, 1),
+        math.sqrt(MAX_IMAGE_PIXELS / max(width * height, 1)),
+    )
+    return math.ceil(width * scale * height * scale / PIXELS_PER_TOKEN)
+
+
+def estimate_block_tokens(block: object) -> int:
+    """Estimate the tokens of a content block param (text, image, tool_use, tool_result)."""
+    if isinstance(block, str):
+        return estimate_text_tokens(block)
+    if not isinstance(block, dict):
+        return 0
+    block_type = block.get("type")
+    if block_type == "text":
+        return estimate_text_tokens(block["text"])
+    if block_type == "image":
+        source = block["source"]
+        if source.get("type") == "base64":
+            return estimate_image_tokens(*image_size(source["data"]))
+        if source.get("type") == "image_ref":
+            return estimate_image_tokens(source["width"], source["height"])
+        return estimate_image_tokens(*DEFAULT_IMAGE_SIZE)
+    if block_type == "tool_use":
+        return estimate_text_tokens(f'{block["name"]}{block["input"]}')
+    if block_type == "tool_result":
+        content = block.get("content", [])
+        if isinstance(content, str):
+            return estimate_text_tokens(content)
+        return sum(estimate_block_tokens(item) for item in content)
+    return 0
+
+
+def estimate_message_tokens(message: BetaMessageParam) -> int:
+    content = message["content"]
+    if isinstance(content, str):
+        return estimate_text_tokens(content)
+    return sum(estimate_block_tokens(block) for block in content)
+
+
+def estimate_tools_tokens(tools: list[BetaToolUnionParam]) -> int:
+    if not tools:
+        return 0
+    return TOOL_USE_SYSTEM_PROMPT_TOKENS + sum(
+        ANTHROPIC_TOOL_TOKENS.get(str(tool.get("type")))
+        or estimate_text_tokens(json.dumps(tool))
+        for tool in tools
+    )
+
+
+def estimate_block_bytes(block: object) -> int:
+    """Estimate the JSON-encoded size of a content block param, without encoding it."""
+    if isinstance(block, str):
+        return len(block) + BLOCK_OVERHEAD_BYTES
+    if not isinstance(block, dict):
+        return 0
+    block_type = block.get("type")
+    if block_type == "text":
+        return len(block["text"]) + BLOCK_OVERHEAD_BYTES
+    if block_type == "image":
+        source = block["source"]
+        if source.get("type") == "image_ref":
+            return base64_length(source["size"]) + BLOCK_OVERHEAD_BYTES
+        return len(source.get("data", "")) + BLOCK_OVERHEAD_BYTES
+    if block_type == "tool_use":
+        return len(json.dumps(block["input"])) + BLOCK_OVERHEAD_BYTES
+    if block_type == "tool_result":
+        content = block.get("content", [])
+        if isinstance(content, str):
+            return len(content) + BLOCK_OVERHEAD_BYTES
+        return BLOCK_OVERHEAD_BYTES + sum(
+            estimate_block_bytes(item) for item in content
+        )
+    return BLOCK_OVERHEAD_BYTES
+
+
+def estimate_message_bytes(message: BetaMessageParam) -> int:
+    content = message["content"]
+    if isinstance(content, str):
+        return len(content) + BLOCK_OVERHEAD_BYTES
+    return BLOCK_OVERHEAD_BYTES + sum(estimate_block_bytes(block) for block in content)
+
+
+def estimate_request(
+    system: str,
+    tools: list[BetaToolUnionParam],
+    messages: list[BetaMessageParam],
+) -> RequestEstimate:
+    """Estimate the input tokens and body size of a Messages API request."""
+    return RequestEstimate(
+        tokens=estimate_text_tokens(system)
+        + estimate_tools_tokens(tools)
+        + sum(estimate_message_tokens(message) for message in messages),
+        bytes=len(system)
+        + len(json.dumps(tools))
+        + sum(estimate_message_bytes(message) for message in messages),
+    )
@@ -4,6 +4,9 @@ from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+# the resource of calls that may touch anything: files, processes, the screen
+ALL_RESOURCES = "*"
+
 
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic-defined tools."""
@@ -19,6 +22,18 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    def resources(self, **kwargs) -> frozenset[str]:
+        """
+        Names of the resources a call with these arguments needs exclusive access to.
+
+        Calls that share a resource are run one after another, in the order they
+        were requested; all others may run concurrently. By default a call needs
+        `ALL_RESOURCES`, and conflicts with every other call of any tool: only
+        tools that know which calls are safe to overlap (like editor calls on
+        different files) narrow it down.
+        """
+        return frozenset({ALL_RESOURCES})
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -1,9 +1,11 @@
 import asyncio
 import os
+import signal
 from typing import ClassVar, Literal
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
+from .. import tracing
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
 
 
@@ -26,25 +28,30 @@ class _BashSession:
         if self._started:
             return
 
-        self._process = await asyncio.create_subprocess_shell(
-            self.command,
-            preexec_fn=os.setsid,
-            shell=True,
-            bufsize=0,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        with tracing.span("bash.start"):
+            self._process = await asyncio.create_subprocess_shell(
+                self.command,
+                preexec_fn=os.setsid,
+                shell=True,
+                bufsize=0,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
 
         self._started = True
 
     def stop(self):
-        """Terminate the bash shell."""
+        """Terminate the bash shell, and the commands it is running."""
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
             return
-        self._process.terminate()
+        try:
+            # the shell leads its own process group, see `start`
+            os.killpg(self._process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
 
     async def run(self, command: str):
         """Execute a command in the bash shell."""
@@ -133,7 +140,14 @@ class BashTool(BaseAnthropicTool):
             await self._session.start()
 
         if command is not None:
-            return await self._session.run(command)
+            try:
+                return await self._session.run(command)
+            except asyncio.CancelledError:
+                # the shell is stuck in the middle of the command, the next call
+                # starts a fresh one
+                self._session.stop()
+                self._session = None
+                raise
 
         raise ToolError("no command provided.")
 
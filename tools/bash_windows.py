@@ -10,6 +10,18 @@ from asyncio.subprocess import PIPE
 from ..tools.base import BaseAnthropicTool, ToolError, ToolResult
 
 
+async def _communicate(process: asyncio.subprocess.Process) -> tuple[bytes, bytes]:
+    """`process.communicate()`, killing the process if the call is cancelled."""
+    try:
+        return await process.communicate()
+    except asyncio.CancelledError:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        raise
+
+
 class AsyncWindowsShell:
     """Async wrapper for Windows command shell."""
     
@@ -310,7 +322,7 @@ Command Exists: {os.path.exists(cmd_path)}"""
                     creationflags=subprocess.CREATE_NO_WINDOW,
                     shell=use_shell
                 )
-                stdout, stderr = await process.communicate()
+                stdout, stderr = await _communicate(process)
                 try:
                     output = stdout.decode('utf-8') if stdout else ''
                 except UnicodeDecodeError:
@@ -389,7 +401,7 @@ Command Exists: {os.path.exists(cmd_path)}"""
                 cwd=cwd
             )
 
-            stdout, stderr = await process.communicate()
+            stdout, stderr = await _communicate(process)
             
             try:
                 stdout_str = stdout.decode('utf-8') if stdout else ''
@@ -406,7 +418,7 @@ Command Exists: {os.path.exists(cmd_path)}"""
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE
                 )
-                verify_out, _ = await verify_process.communicate()
+                verify_out, _ = await _communicate(verify_process)
                 verify_str = verify_out.decode('utf-8', errors='ignore')
                 
                 if command.lower().startswith(('md ', 'mkdir ')):
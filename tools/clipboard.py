@@ -0,0 +1,131 @@
+"""
+Typing long text by pasting it from the X clipboard, with xclip.
+
+The text is offered by an xclip in the foreground that exits once it has served
+one request for it, so a paste that no application asked for, like one into a
+target that ignores the paste keys, can be told apart from one that worked.
+"""
+
+import asyncio
+import os
+import shutil
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from .. import tracing
+from .run import kill
+
+# seconds for xclip to read or offer the clipboard
+CLIPBOARD_TIMEOUT = 1.0
+# seconds for the focused application to request the text after the paste keys
+PASTE_TIMEOUT = 1.0
+# printed by `xclip -verbose` once it owns the clipboard
+_OWNING_MESSAGE = b"Waiting for selection request"
+
+
+def available() -> bool:
+    return shutil.which("xclip") is not None
+
+
+async def get_clipboard(xdisplay: str | None) -> bytes | None:
+    """The text on the clipboard, or None when it holds no text."""
+    process = await _xclip(
+        xdisplay,
+        "-out",
+        "-target",
+        "UTF8_STRING",
+        stdout=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), CLIPBOARD_TIMEOUT)
+    except asyncio.TimeoutError:
+        kill(process)
+        return None
+    return stdout if process.returncode == 0 else None
+
+
+async def set_clipboard(xdisplay: str | None, text: bytes):
+    """Put `text` on the clipboard, offered by an xclip left in the background."""
+    process = await _xclip(xdisplay, "-in", stdin=asyncio.subprocess.PIPE)
+    try:
+        # returns once xclip has forked the process that owns the clipboard
+        await asyncio.wait_for(process.communicate(text), CLIPBOARD_TIMEOUT)
+    except asyncio.TimeoutError:
+        kill(process)
+
+
+async def paste(
+    xdisplay: str | None,
+    text: str,
+    send_paste_keys: Callable[[], Awaitable[Any]],
+) -> bool:
+    """
+    Put `text` on the clipboard, call `send_paste_keys`, and put the text that
+    was on the clipboard before back (other contents, like images, are lost).
+    False, with nothing pasted, when the application didn't request the text
+    within PASTE_TIMEOUT seconds.
+    """
+    with tracing.span("clipboard.paste", length=len(text)) as span:
+        previous = await get_clipboard(xdisplay)
+        owner = await _xclip(
+            xdisplay,
+            "-in",
+            "-verbose",
+            "-loops",
+            "1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            assert owner.stdin and owner.stdout
+            owner.stdin.write(text.encode())
+            await owner.stdin.drain()
+            owner.stdin.close()
+            try:
+                owning = await asyncio.wait_for(
+                    _wait_for_owning(owner.stdout), CLIPBOARD_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                owning = False
+            if not owning:
+                span.set_attribute("pasted", False)
+                return False
+            await send_paste_keys()
+            try:
+                await asyncio.wait_for(owner.wait(), PASTE_TIMEOUT)
+            except asyncio.TimeoutError:
+                span.set_attribute("pasted", False)
+                return False
+            span.set_attribute("pasted", True)
+            return True
+        finally:
+            kill(owner)
+            await owner.wait()
+            if previous is not None:
+                await set_clipboard(xdisplay, previous)
+
+
+async def _wait_for_owning(stdout: asyncio.StreamReader) -> bool:
+    while line := await stdout.readline():
+        if _OWNING_MESSAGE in line:
+            return True
+    return False
+
+
+async def _xclip(
+    xdisplay: str | None, *args: str, **kwargs: Any
+) -> asyncio.subprocess.Process:
+    env = {**os.environ, "DISPLAY": xdisplay} if xdisplay else None
+    kwargs.setdefault("stdout", asyncio.subprocess.DEVNULL)
+    kwargs.setdefault("stderr", asyncio.subprocess.DEVNULL)
+    # in its own process group, so it can be killed with its children
+    return await asyncio.create_subprocess_exec(
+        "xclip",
+        "-selection",
+        "clipboard",
+        *args,
+        env=env,
+        start_new_session=True,
+        **kwargs,
+    )
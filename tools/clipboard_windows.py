@@ -0,0 +1,108 @@
+"""
+Typing long text by pasting it from the Windows clipboard.
+
+The text is put on the clipboard with delayed rendering: Windows asks the hidden
+window that owns the clipboard for it only when an application pastes, so a
+paste that no application asked for, like one into a target that ignores the
+paste keys, can be told apart from one that worked.
+"""
+
+import time
+from collections.abc import Callable
+from typing import Any
+
+import pywintypes
+import win32clipboard
+import win32con
+import win32gui
+
+# seconds for the focused application to request the text after the paste keys
+PASTE_TIMEOUT = 1.0
+# seconds for an application that is reading the clipboard to close it again
+CLIPBOARD_TIMEOUT = 1.0
+_POLL_INTERVAL = 0.01
+
+
+def paste(text: str, send_paste_keys: Callable[[], Any]) -> bool:
+    """
+    Put `text` on the clipboard, call `send_paste_keys`, and put the text that
+    was on the clipboard before back (other contents, like images, are lost).
+    False, with nothing pasted, when no application requested the text within
+    PASTE_TIMEOUT seconds. Raises pywintypes.error, before sending the keys,
+    when the clipboard can't be taken.
+
+    Blocking, and to be called in a thread of its own: the window that owns the
+    clipboard is served by the thread that created it.
+    """
+    requested = False
+
+    def window_proc(hwnd, message, wparam, lparam):
+        nonlocal requested
+        if message == win32con.WM_RENDERFORMAT and wparam == win32con.CF_UNICODETEXT:
+            # the clipboard is open by the application asking
+            win32clipboard.SetClipboardText(text, win32con.CF_UNICODETEXT)
+            requested = True
+            return 0
+        return win32gui.CallWindowProc(default_proc, hwnd, message, wparam, lparam)
+
+    hwnd = win32gui.CreateWindow(
+        "STATIC", None, 0, 0, 0, 0, 0, win32con.HWND_MESSAGE, 0, 0, None
+    )
+    default_proc = win32gui.SetWindowLong(hwnd, win32con.GWL_WNDPROC, window_proc)
+    previous = None
+    owned = sent = False
+    try:
+        _open_clipboard(hwnd)
+        try:
+            if win32clipboard.IsClipboardFormatAvailable(win32con.CF_UNICODETEXT):
+                previous = win32clipboard.GetClipboardData(win32con.CF_UNICODETEXT)
+            # makes the window the owner, to be asked for the text
+            win32clipboard.EmptyClipboard()
+            owned = True
+            win32clipboard.SetClipboardData(win32con.CF_UNICODETEXT, None)
+        finally:
+            win32clipboard.CloseClipboard()
+
+        send_paste_keys()
+        sent = True
+        deadline = time.monotonic() + PASTE_TIMEOUT
+        while not requested and time.monotonic() < deadline:
+            win32gui.PumpWaitingMessages()
+            time.sleep(_POLL_INTERVAL)
+        return requested
+    finally:
+        try:
+            if owned:
+                _restore_clipboard(hwnd, previous)
+        except pywintypes.error:
+            # once the keys are sent the text may have been pasted, and must
+            # not be typed again because the clipboard couldn't be restored
+            if not sent:
+                raise
+        finally:
+            win32gui.DestroyWindow(hwnd)
+
+
+def _restore_clipboard(hwnd: int, text: str | None):
+    # opened by the window, a clipboard opened without one can't be set; this
+    # waits for the application pasting to have read the text
+    _open_clipboard(hwnd)
+    try:
+        win32clipboard.EmptyClipboard()
+        if text is not None:
+            win32clipboard.SetClipboardText(text, win32con.CF_UNICODETEXT)
+    finally:
+        win32clipboard.CloseClipboard()
+
+
+def _open_clipboard(hwnd: int):
+    """Open the clipboard, which fails while another application has it open."""
+    deadline = time.monotonic() + CLIPBOARD_TIMEOUT
+    while True:
+        try:
+            win32clipboard.OpenClipboard(hwnd)
+            return
+        except pywintypes.error:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(_POLL_INTERVAL)
@@ -1,10 +1,15 @@
 """Collection classes for managing multiple tools."""
 
+import asyncio
+import time
+from contextlib import nullcontext
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from .. import tracing
 from .base import (
+    ALL_RESOURCES,
     BaseAnthropicTool,
     ToolError,
     ToolFailure,
@@ -13,11 +18,35 @@ from .base import (
 
 
 class ToolCollection:
-    """A collection of anthropic-defined tools."""
+    """
+    A collection of anthropic-defined tools.
 
-    def __init__(self, *tools: BaseAnthropicTool):
+    Besides running a single tool call with `run`, the collection schedules calls
+    submitted with `submit`/`run_many`: calls that need the same resource (see
+    `BaseAnthropicTool.resources`) run in submission order, and a call needing
+    `ALL_RESOURCES` (like any bash command) runs after every call submitted
+    before it and before every call submitted after it. All others run
+    concurrently, optionally capped per tool by `concurrency_limits`.
+    """
+
+    def __init__(
+        self,
+        *tools: BaseAnthropicTool,
+        concurrency_limits: dict[str, int] | None = None,
+    ):
         self.tools = tools
         self.tool_map = {tool.to_params()["name"]: tool for tool in tools}
+        self._semaphores = {
+            name: asyncio.Semaphore(limit)
+            for name, limit in (concurrency_limits or {}).items()
+        }
+        # the most recently submitted call holding each resource
+        self._resource_holders: dict[str, asyncio.Task[ToolResult]] = {}
+        # calls submitted and not finished, and the last one needing everything
+        self._unfinished: set[asyncio.Task[ToolResult]] = set()
+        self._exclusive_holder: asyncio.Task[ToolResult] | None = None
+        # seconds spent running (not queued) for calls submitted with a call_id
+        self.durations: dict[str, float] = {}
 
     def to_params(
         self,
@@ -28,7 +57,95 @@ class ToolCollection:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
+        with tracing.span(
+            f"tool.{name}",
+            action=tool_input.get("action"),
+            command=tool_input.get("command"),
+        ) as span:
+            try:
+                return await tool(**tool_input)
+            except ToolError as e:
+                span.set_attribute("tool_error", e.message)
+                return ToolFailure(error=e.message)
+
+    def submit(
+        self, *, name: str, tool_input: dict[str, Any], call_id: str | None = None
+    ) -> asyncio.Task[ToolResult]:
+        """
+        Schedule a tool call and return its task. The call starts once every
+        earlier submitted call it shares a resource with has finished. With a
+        `call_id`, the time it spent running is stored in `durations`.
+        """
+        resources = self._resources(name, tool_input)
+        exclusive = ALL_RESOURCES in resources
+        if exclusive:
+            blockers = set(self._unfinished)
+        else:
+            blockers = {
+                self._resource_holders[resource]
+                for resource in resources
+                if resource in self._resource_holders
+            }
+            if self._exclusive_holder is not None:
+                blockers.add(self._exclusive_holder)
+        task = asyncio.create_task(
+            self._run_after(blockers, name=name, tool_input=tool_input, call_id=call_id)
+        )
+        self._unfinished.add(task)
+        if exclusive:
+            self._exclusive_holder = task
+        else:
+            for resource in resources:
+                self._resource_holders[resource] = task
+
+        def release(task: asyncio.Task[ToolResult]):
+            self._unfinished.discard(task)
+            if self._exclusive_holder is task:
+                self._exclusive_holder = None
+            for resource in resources:
+                if self._resource_holders.get(resource) is task:
+                    del self._resource_holders[resource]
+
+        task.add_done_callback(release)
+        return task
+
+    async def run_many(
+        self, calls: list[tuple[str, dict[str, Any]]]
+    ) -> list[ToolResult]:
+        """Run (name, tool_input) calls concurrently where they don't conflict."""
+        tasks = [
+            self.submit(name=name, tool_input=tool_input) for name, tool_input in calls
+        ]
         try:
-            return await tool(**tool_input)
-        except ToolError as e:
-            return ToolFailure(error=e.message)
+            return [await task for task in tasks]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _resources(self, name: str, tool_input: dict[str, Any]) -> frozenset[str]:
+        tool = self.tool_map.get(name)
+        if not tool:
+            return frozenset()
+        try:
+            return tool.resources(**tool_input)
+        except Exception:
+            # malformed input will fail in the tool itself, just keep it in order
+            return frozenset({ALL_RESOURCES})
+
+    async def _run_after(
+        self,
+        blockers: set[asyncio.Task[ToolResult]],
+        *,
+        name: str,
+        tool_input: dict[str, Any],
+        call_id: str | None,
+    ) -> ToolResult:
+        if blockers:
+            await asyncio.wait(blockers)
+        async with self._semaphores.get(name) or nullcontext():
+            start = time.perf_counter()
+            try:
+                return await self.run(name=name, tool_input=tool_input)
+            finally:
+                if call_id is not None:
+                    self.durations[call_id] = time.perf_counter() - start
@@ -3,20 +3,30 @@ import base64
 import os
 import shlex
 import shutil
+from collections.abc import Awaitable
 from enum import StrEnum
+from functools import partial
 from pathlib import Path
-from typing import Literal, TypedDict
+from typing import Any, Literal, TypedDict
 from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
+from .. import tracing
+from . import clipboard
 from .base import BaseAnthropicTool, ToolError, ToolResult
+from .png import encode_png
 from .run import run
+from .settle import SettleResult, grab_frame, grab_screen, wait_until_settled
+from .xinput import UnsupportedInput, XInputDriver
 
 OUTPUT_DIR = "/tmp/outputs"
 
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
+# longer text is pasted from the clipboard, if the focused application takes it
+PASTE_THRESHOLD = 200
+PASTE_KEYS = "ctrl+v"
 
 Action = Literal[
     "key",
@@ -73,8 +83,18 @@ class ComputerTool(BaseAnthropicTool):
     height: int
     display_num: int | None
 
+    # the longest wait for the screen to settle before a screenshot
     _screenshot_delay = 2.0
+    # with it off (or when frames can't be grabbed) the full delay is waited
+    _settle_detection = True
+    # capture in-process over XCB, falling back to screenshot commands
+    _in_process_capture = True
+    # send input over one XTest connection, falling back to an xdotool per action
+    _in_process_input = True
+    # paste long text rather than type it, see PASTE_THRESHOLD
+    _paste_text = True
     _scaling_enabled = True
+    last_settle: SettleResult | None = None
 
     @property
     def options(self) -> ComputerToolOptions:
@@ -90,6 +110,10 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
+    def resources(self, **kwargs) -> frozenset[str]:
+        # every action reads or changes the one shared screen
+        return frozenset({"screen"})
+
     def __init__(self):
         super().__init__()
 
@@ -99,11 +123,14 @@ class ComputerTool(BaseAnthropicTool):
         if (display_num := os.getenv("DISPLAY_NUM")) is not None:
             self.display_num = int(display_num)
             self._display_prefix = f"DISPLAY=:{self.display_num} "
+            self._xdisplay = f":{self.display_num}"
         else:
             self.display_num = None
             self._display_prefix = ""
+            self._xdisplay = None
 
         self.xdotool = f"{self._display_prefix}xdotool"
+        self._input: XInputDriver | None = None
 
     async def __call__(
         self,
@@ -127,6 +154,11 @@ class ComputerTool(BaseAnthropicTool):
                 ScalingSource.API, coordinate[0], coordinate[1]
             )
 
+            if driver := self._input_driver():
+                if action == "mouse_move":
+                    return await self.input(driver.move(x, y))
+                elif action == "left_click_drag":
+                    return await self.input(driver.drag(x, y))
             if action == "mouse_move":
                 return await self.shell(f"{self.xdotool} mousemove --sync {x} {y}")
             elif action == "left_click_drag":
@@ -143,12 +175,15 @@ class ComputerTool(BaseAnthropicTool):
                 raise ToolError(output=f"{text} must be a string")
 
             if action == "key":
-                return await self.shell(f"{self.xdotool} key -- {text}")
+                return await self._key(text)
             elif action == "type":
+                if await self._paste(text):
+                    return ToolResult(
+                        base64_image=(await self.screenshot()).base64_image
+                    )
                 results: list[ToolResult] = []
                 for chunk in chunks(text, TYPING_GROUP_SIZE):
-                    cmd = f"{self.xdotool} type --delay {TYPING_DELAY_MS} -- {shlex.quote(chunk)}"
-                    results.append(await self.shell(cmd, take_screenshot=False))
+                    results.append(await self._type(chunk))
                 screenshot_base64 = (await self.screenshot()).base64_image
                 return ToolResult(
                     output="".join(result.output or "" for result in results),
@@ -172,6 +207,11 @@ class ComputerTool(BaseAnthropicTool):
             if action == "screenshot":
                 return await self.screenshot()
             elif action == "cursor_position":
+                if driver := self._input_driver():
+                    x, y = self.scale_coordinates(
+                        ScalingSource.COMPUTER, *await driver.cursor_position()
+                    )
+                    return ToolResult(output=f"X={x},Y={y}")
                 result = await self.shell(
                     f"{self.xdotool} getmouselocation --shell",
                     take_screenshot=False,
@@ -183,6 +223,14 @@ class ComputerTool(BaseAnthropicTool):
                     int(output.split("Y=")[1].split("\n")[0]),
                 )
                 return result.replace(output=f"X={x},Y={y}")
+            elif driver := self._input_driver():
+                button, repeat = {
+                    "left_click": (1, 1),
+                    "right_click": (3, 1),
+                    "middle_click": (2, 1),
+                    "double_click": (1, 2),
+                }[action]
+                return await self.input(driver.click(button, repeat, delay=0.5))
             else:
                 click_arg = {
                     "left_click": "1",
@@ -194,8 +242,78 @@ class ComputerTool(BaseAnthropicTool):
 
         raise ToolError(f"Invalid action: {action}")
 
+    async def _key(self, keys: str, take_screenshot=True) -> ToolResult:
+        if driver := self._input_driver():
+            try:
+                return await self.input(driver.key(keys), take_screenshot)
+            except UnsupportedInput:
+                pass
+        return await self.shell(f"{self.xdotool} key -- {keys}", take_screenshot)
+
+    async def _paste(self, text: str) -> bool:
+        """Paste `text` if it is long enough, False if it has to be typed."""
+        if not (
+            self._paste_text and len(text) > PASTE_THRESHOLD and clipboard.available()
+        ):
+            return False
+        return await clipboard.paste(
+            self._xdisplay, text, partial(self._key, PASTE_KEYS, take_screenshot=False)
+        )
+
+    async def _type(self, chunk: str) -> ToolResult:
+        if driver := self._input_driver():
+            try:
+                return await self.input(
+                    driver.type(chunk, TYPING_DELAY_MS / 1000), take_screenshot=False
+                )
+            except UnsupportedInput:
+                pass
+        cmd = f"{self.xdotool} type --delay {TYPING_DELAY_MS} -- {shlex.quote(chunk)}"
+        return await self.shell(cmd, take_screenshot=False)
+
+    def _input_driver(self) -> XInputDriver | None:
+        """The in-process input driver, connected on first use, if it can be."""
+        if self._input is None and self._in_process_input:
+            try:
+                self._input = XInputDriver(self._xdisplay)
+            except OSError:
+                # no X connection, or no libX11/libXtst
+                self._in_process_input = False
+        return self._input
+
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
+        with tracing.span("computer.screenshot"):
+            return await self._screenshot()
+
+    async def _screenshot(self):
+        if self._in_process_capture:
+            try:
+                return await self._capture_in_process()
+            except Exception:
+                # no X connection, Pillow without XCB support, or any other
+                # failure: the screenshot commands from now on
+                self._in_process_capture = False
+        return await self._capture_with_subprocess()
+
+    async def _capture_in_process(self) -> ToolResult:
+        """Grab, scale and encode the screen in memory, over Pillow's XCB support."""
+        with tracing.span("computer.capture", backend="xcb"):
+            screenshot = await asyncio.to_thread(grab_screen, self._xdisplay)
+        if self._scaling_enabled:
+            x, y = self.scale_coordinates(
+                ScalingSource.COMPUTER, self.width, self.height
+            )
+            with tracing.span("computer.scale", width=x, height=y):
+                screenshot = await asyncio.to_thread(screenshot.resize, (x, y))
+        with tracing.span("computer.encode") as span:
+            png = await asyncio.to_thread(encode_png, screenshot)
+            base64_image = base64.b64encode(png).decode()
+            span.set_attribute("bytes", len(png))
+        return ToolResult(base64_image=base64_image)
+
+    async def _capture_with_subprocess(self) -> ToolResult:
+        """Capture with gnome-screenshot or scrot, and scale with ImageMagick."""
         output_dir = Path(OUTPUT_DIR)
         output_dir.mkdir(parents=True, exist_ok=True)
         path = output_dir / f"screenshot_{uuid4().hex}.png"
@@ -207,19 +325,21 @@ class ComputerTool(BaseAnthropicTool):
             # Fall back to scrot if gnome-screenshot isn't available
             screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
 
-        result = await self.shell(screenshot_cmd, take_screenshot=False)
+        with tracing.span("computer.capture", backend="subprocess"):
+            result = await self.shell(screenshot_cmd, take_screenshot=False)
         if self._scaling_enabled:
             x, y = self.scale_coordinates(
                 ScalingSource.COMPUTER, self.width, self.height
             )
-            await self.shell(
-                f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
-            )
+            with tracing.span("computer.scale", width=x, height=y):
+                await self.shell(
+                    f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
+                )
 
         if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
+            with tracing.span("computer.encode"):
+                base64_image = base64.b64encode(path.read_bytes()).decode()
+            return result.replace(base64_image=base64_image)
         raise ToolError(f"Failed to take screenshot: {result.error}")
 
     async def shell(self, command: str, take_screenshot=True) -> ToolResult:
@@ -228,12 +348,52 @@ class ComputerTool(BaseAnthropicTool):
         base64_image = None
 
         if take_screenshot:
-            # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
-            base64_image = (await self.screenshot()).base64_image
+            base64_image = await self._settled_screenshot()
 
         return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
 
+    async def input(self, request: Awaitable[Any], take_screenshot=True) -> ToolResult:
+        """Await an input driver request, and optionally return a screenshot."""
+        with tracing.span("computer.input"):
+            await request
+        base64_image = None
+
+        if take_screenshot:
+            base64_image = await self._settled_screenshot()
+
+        return ToolResult(base64_image=base64_image)
+
+    async def _settled_screenshot(self) -> str | None:
+        # let things settle before taking a screenshot
+        with tracing.span(
+            "computer.settle", max_seconds=self._screenshot_delay
+        ) as span:
+            self.last_settle = await self.wait_until_settled()
+            span.set_attributes(
+                seconds=self.last_settle.seconds,
+                frames=self.last_settle.frames,
+                settled=self.last_settle.settled,
+            )
+        return (await self.screenshot()).base64_image
+
+    async def wait_until_settled(self) -> SettleResult:
+        """
+        Wait until the screen stops changing, for at most `_screenshot_delay`
+        seconds (see `settle.py`).
+        """
+        if self._settle_detection:
+            try:
+                return await wait_until_settled(
+                    partial(grab_frame, self._xdisplay),
+                    max_seconds=self._screenshot_delay,
+                )
+            except Exception:
+                # no X connection, Pillow without XCB support, or any other
+                # failure: a fixed delay from now on
+                self._settle_detection = False
+        await asyncio.sleep(self._screenshot_delay)
+        return SettleResult(self._screenshot_delay, 0, False)
+
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates to a target maximum resolution."""
         if not self._scaling_enabled:
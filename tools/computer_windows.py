@@ -5,21 +5,24 @@ import win32gui
 import win32api
 import win32con
 import pyautogui
+import pywintypes
 from enum import StrEnum
-from pathlib import Path
+from functools import partial
 from typing import Literal, TypedDict
-from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
+from .. import tracing
 from .base import BaseAnthropicTool, ToolError, ToolResult
+from .clipboard_windows import paste
+from .png import encode_png
 from .run import run
 
-# Windows temp directory for outputs
-OUTPUT_DIR = os.path.join(os.getenv('TEMP', os.path.expanduser('~')), 'anthropic_outputs')
-
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
+# longer text is pasted from the clipboard, if the focused application takes it
+PASTE_THRESHOLD = 200
+PASTE_KEYS = ("ctrl", "v")
 
 Action = Literal[
     "key",
@@ -77,6 +80,8 @@ class ComputerTool(BaseAnthropicTool):
     display_num: int | None
 
     _screenshot_delay = 2.0
+    # paste long text rather than type it, see PASTE_THRESHOLD
+    _paste_text = True
     _scaling_enabled = True
 
     @property
@@ -93,6 +98,10 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
+    def resources(self, **kwargs) -> frozenset[str]:
+        # every action reads or changes the one shared screen
+        return frozenset({"screen"})
+
     def __init__(self):
         super().__init__()
 
@@ -149,9 +158,16 @@ class ComputerTool(BaseAnthropicTool):
                     raise ToolError(f"Failed to send key: {e}")
                 return ToolResult()
             elif action == "type":
+                if await self._paste(text):
+                    return ToolResult(
+                        base64_image=(await self.screenshot()).base64_image
+                    )
                 results: list[ToolResult] = []
                 for chunk in chunks(text, TYPING_GROUP_SIZE):
-                    pyautogui.write(chunk, interval=TYPING_DELAY_MS/1000)
+                    # typed in a thread, so a cancelled call stops after this chunk
+                    await asyncio.to_thread(
+                        pyautogui.write, chunk, interval=TYPING_DELAY_MS / 1000
+                    )
                     results.append(ToolResult())
                 screenshot_base64 = (await self.screenshot()).base64_image
                 return ToolResult(
@@ -195,32 +211,40 @@ class ComputerTool(BaseAnthropicTool):
 
         raise ToolError(f"Invalid action: {action}")
 
+    async def _paste(self, text: str) -> bool:
+        """Paste `text` if it is long enough, False if it has to be typed."""
+        if not (self._paste_text and len(text) > PASTE_THRESHOLD):
+            return False
+        try:
+            return await asyncio.to_thread(
+                paste, text, partial(pyautogui.hotkey, *PASTE_KEYS)
+            )
+        except pywintypes.error:
+            # the clipboard is kept open by another application
+            return False
+
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
+        with tracing.span("computer.screenshot"):
+            return await self._screenshot()
 
+    async def _screenshot(self):
         try:
-            screenshot = pyautogui.screenshot()
+            with tracing.span("computer.capture"):
+                screenshot = pyautogui.screenshot()
             if self._scaling_enabled:
                 x, y = self.scale_coordinates(
                     ScalingSource.COMPUTER, self.width, self.height
                 )
-                screenshot = screenshot.resize((x, y))
-            
-            # Compress the image to ensure it's under 5MB
-            max_size = 5 * 1024 * 1024  # 5MB in bytes
-            quality = 95
-            while True:
-                # Save with compression
-                screenshot.save(str(path), "PNG", optimize=True, quality=quality)
-                if path.stat().st_size <= max_size or quality <= 5:
-                    break
-                quality -= 5  # Reduce quality if file is too large
-            return ToolResult(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
+                with tracing.span("computer.scale", width=x, height=y):
+                    screenshot = screenshot.resize((x, y))
+
+            # in memory, within the API's image size limit
+            with tracing.span("computer.encode") as span:
+                png = await asyncio.to_thread(encode_png, screenshot)
+                base64_image = base64.b64encode(png).decode()
+                span.set_attribute("bytes", len(png))
+            return ToolResult(base64_image=base64_image)
         except Exception as e:
             raise ToolError(f"Failed to take screenshot: {e}")
 
@@ -4,8 +4,10 @@ from typing import Literal, get_args
 
 from anthropic.types.beta import BetaToolTextEditor20241022Param
 
+from .. import tracing
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
 from .run import maybe_truncate, run
+from .view_cache import ViewCache, directory_state, file_state
 
 Command = Literal[
     "view",
@@ -16,6 +18,9 @@ Command = Literal[
 ]
 SNIPPET_LINES: int = 4
 
+# shared by the tools of all sessions, entries are keyed on the file state
+_view_cache = ViewCache()
+
 
 class EditTool(BaseAnthropicTool):
     """
@@ -27,9 +32,11 @@ class EditTool(BaseAnthropicTool):
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
     _file_history: dict[Path, list[str]]
+    view_cache: ViewCache
 
-    def __init__(self):
+    def __init__(self, view_cache: ViewCache | None = None):
         self._file_history = defaultdict(list)
+        self.view_cache = view_cache if view_cache is not None else _view_cache
         super().__init__()
 
     def to_params(self) -> BetaToolTextEditor20241022Param:
@@ -38,6 +45,10 @@ class EditTool(BaseAnthropicTool):
             "type": self.api_type,
         }
 
+    def resources(self, *, path: str, **kwargs) -> frozenset[str]:
+        # only calls on the same file conflict with each other
+        return frozenset({f"path:{Path(path).resolve()}"})
+
     async def __call__(
         self,
         *,
@@ -107,7 +118,33 @@ class EditTool(BaseAnthropicTool):
                 )
 
     async def view(self, path: Path, view_range: list[int] | None = None):
-        """Implement the view command"""
+        """
+        Implement the view command. Results are cached until the file (or, for a
+        directory, its listing) changes.
+        """
+        if view_range is not None and not (
+            isinstance(view_range, list) and all(isinstance(i, int) for i in view_range)
+        ):
+            # malformed, let the uncached path report it
+            return await self._view(path, view_range)
+        resolved = path.resolve()
+        try:
+            if path.is_dir():
+                key = ("dir", directory_state(path), tuple(view_range or ()))
+            else:
+                key = ("file", file_state(path), tuple(view_range or ()))
+        except OSError:
+            return await self._view(path, view_range)
+        if (result := self.view_cache.get(resolved, key)) is not None:
+            tracing.current_span().set_attribute("cache_hit", True)
+            return result
+        result = await self._view(path, view_range)
+        # failed listings may be transient
+        if not result.error:
+            self.view_cache.put(resolved, key, result)
+        return result
+
+    async def _view(self, path: Path, view_range: list[int] | None = None):
         if path.is_dir():
             if view_range:
                 raise ToolError(
@@ -265,6 +302,8 @@ class EditTool(BaseAnthropicTool):
             path.write_text(file)
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
+        finally:
+            self.view_cache.invalidate(path.resolve())
 
     def _make_output(
         self,
@@ -1,6 +1,10 @@
 """Utility to run shell commands asynchronously with a timeout."""
 
 import asyncio
+import os
+import signal
+
+from .. import tracing
 
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 MAX_RESPONSE_LEN: int = 16000
@@ -21,22 +25,43 @@ async def run(
     truncate_after: int | None = MAX_RESPONSE_LEN,
 ):
     """Run a shell command asynchronously with a timeout."""
-    process = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
+    with tracing.span("subprocess", command=cmd) as span:
+        with tracing.span("subprocess.spawn"):
+            # in its own process group, so the whole command line can be killed
+            process = await asyncio.create_subprocess_shell(
+                cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+        span.set_attribute("pid", process.pid)
 
-    try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
-        )
-    except asyncio.TimeoutError as exc:
         try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(), timeout=timeout
+            )
+            span.set_attribute("returncode", process.returncode)
+            return (
+                process.returncode or 0,
+                maybe_truncate(stdout.decode(), truncate_after=truncate_after),
+                maybe_truncate(stderr.decode(), truncate_after=truncate_after),
+            )
+        except asyncio.TimeoutError as exc:
+            kill(process)
+            raise TimeoutError(
+                f"Command '{cmd}' timed out after {timeout} seconds"
+            ) from exc
+        except asyncio.CancelledError:
+            kill(process)
+            raise
+
+
+def kill(process: asyncio.subprocess.Process):
+    """Kill a process started in a new session, along with its children."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
             process.kill()
-        except ProcessLookupError:
-            pass
-        raise TimeoutError(
-            f"Command '{cmd}' timed out after {timeout} seconds"
-        ) from exc
+    except ProcessLookupError:
+        pass
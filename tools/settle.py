@@ -0,0 +1,91 @@
+"""
+Waiting for the screen to settle after an action, instead of a fixed delay.
+
+Small greyscale frames of the screen are grabbed at short intervals, and the
+screen counts as settled once a few consecutive frames show no change beyond
+noise such as a blinking caret.
+"""
+
+import asyncio
+import os
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from PIL import Image, ImageChops, ImageGrab
+
+# seconds between frames
+SETTLE_INTERVAL = 0.1
+# consecutive unchanged frames that count as settled
+SETTLE_STABLE_FRAMES = 2
+# frames are compared at 1/8 of the screen size in each dimension
+FRAME_REDUCTION = 8
+# grey level differences up to this are noise (scaling, antialiasing)
+PIXEL_TOLERANCE = 16
+# share of the frame's pixels that may change, a caret is a handful of pixels
+MAX_CHANGED_FRACTION = 0.001
+
+_CHANGED_LUT = [0] * (PIXEL_TOLERANCE + 1) + [255] * (255 - PIXEL_TOLERANCE)
+
+FrameGrabber = Callable[[], Image.Image]
+
+
+@dataclass(frozen=True)
+class SettleResult:
+    """How long the wait for a settled screen took."""
+
+    seconds: float
+    frames: int
+    # False when the ceiling was reached (or no frames could be grabbed) first
+    settled: bool
+
+
+def grab_screen(xdisplay: str | None = None) -> Image.Image:
+    """
+    The screen of the X display `xdisplay` (or $DISPLAY), read over XCB. Raises
+    OSError when the screen can't be read that way.
+    """
+    # without a display Pillow would run gnome-screenshot and the like instead
+    xdisplay = xdisplay or os.environ.get("DISPLAY")
+    if not xdisplay:
+        raise OSError("No X display to grab, DISPLAY is not set")
+    return ImageGrab.grab(xdisplay=xdisplay)
+
+
+def grab_frame(xdisplay: str | None = None) -> Image.Image:
+    """A small greyscale frame of the screen, see `grab_screen`."""
+    return grab_screen(xdisplay).reduce(FRAME_REDUCTION).convert("L")
+
+
+def frames_differ(a: Image.Image, b: Image.Image) -> bool:
+    if a.size != b.size:
+        return True
+    changed = ImageChops.difference(a, b).point(_CHANGED_LUT).histogram()[255]
+    return changed > MAX_CHANGED_FRACTION * a.width * a.height
+
+
+async def wait_until_settled(
+    grab: FrameGrabber,
+    *,
+    max_seconds: float,
+    interval: float = SETTLE_INTERVAL,
+    stable_frames: int = SETTLE_STABLE_FRAMES,
+) -> SettleResult:
+    """
+    Grab frames every `interval` seconds until `stable_frames` consecutive ones
+    are unchanged, or `max_seconds` have passed. Frames are grabbed in a thread.
+    """
+    start = time.monotonic()
+    deadline = start + max_seconds
+    previous = await asyncio.to_thread(grab)
+    frames = 1
+    stable = 0
+    while (remaining := deadline - time.monotonic()) > 0:
+        await asyncio.sleep(min(interval, remaining))
+        frame = await asyncio.to_thread(grab)
+        frames += 1
+        stable = 0 if frames_differ(previous, frame) else stable + 1
+        previous = frame
+        if stable >= stable_frames:
+            return SettleResult(time.monotonic() - start, frames, True)
+    return SettleResult(time.monotonic() - start, frames, False)
@@ -0,0 +1,89 @@
+"""A cache of read-only tool results, keyed on the state of the files they read."""
+
+import os
+from collections import OrderedDict
+from collections.abc import Hashable
+from pathlib import Path
+
+from .base import ToolResult
+
+# big enough for a few dozen views of large files
+MAX_VIEW_CACHE_BYTES = 16 * 1024 * 1024
+
+
+class ViewCache:
+    """
+    A least recently used cache of tool results, bounded by the size of their
+    text. Keys start with the path they read, and include whatever identifies
+    its state (see `file_state`), so a changed file simply misses; `invalidate`
+    drops a path's entries right away, for changes within the timestamp
+    resolution of the file system.
+    """
+
+    def __init__(self, max_bytes: int = MAX_VIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[Path, Hashable], ToolResult] = OrderedDict()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, path: Path, key: Hashable) -> ToolResult | None:
+        result = self._entries.get((path, key))
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end((path, key))
+        return result
+
+    def put(self, path: Path, key: Hashable, result: ToolResult):
+        size = _size(result)
+        if size > self.max_bytes:
+            return
+        if (old := self._entries.pop((path, key), None)) is not None:
+            self.bytes -= _size(old)
+        self._entries[(path, key)] = result
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= _size(evicted)
+
+    def invalidate(self, path: Path):
+        """Drop the entries of `path` and of the directory listings that show it."""
+        # listings go two levels deep
+        paths = {path, path.parent, path.parent.parent}
+        for entry in [entry for entry in self._entries if entry[0] in paths]:
+            self.bytes -= _size(self._entries.pop(entry))
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+
+def file_state(path: Path) -> tuple[int, int]:
+    """Modification time and size of a file."""
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def directory_state(path: Path) -> tuple[int, ...]:
+    """
+    Modification times of a directory and its visible subdirectories, which
+    change whenever an entry two levels deep is added, removed or renamed.
+    """
+    with os.scandir(path) as entries:
+        subdirectories = sorted(
+            (entry.name, entry.stat(follow_symlinks=False).st_mtime_ns)
+            for entry in entries
+            if not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False)
+        )
+    return (path.stat().st_mtime_ns, *(mtime for _, mtime in subdirectories))
+
+
+def _size(result: ToolResult) -> int:
+    return len(result.output or "") + len(result.error or "")
@@ -0,0 +1,289 @@
+"""
+Keyboard and mouse input over one long-lived X connection with the XTest
+extension, instead of an xdotool process per action.
+
+Requests are run one at a time on the driver's own thread, the only one to use
+the connection, and each returns once the X server has processed its events
+(an XSync round trip), like `xdotool --sync`.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TypeVar
+
+T = TypeVar("T")
+
+# xdotool's names for modifiers, which X doesn't know
+KEY_ALIASES = {
+    "alt": "Alt_L",
+    "ctrl": "Control_L",
+    "control": "Control_L",
+    "meta": "Meta_L",
+    "super": "Super_L",
+    "shift": "Shift_L",
+}
+# characters typed as keys of their own, rather than their Latin-1 keysym
+CHARACTER_KEYSYMS = {"\n": 0xFF0D, "\t": 0xFF09}  # Return, Tab
+
+_NO_SYMBOL = 0
+_UNICODE_KEYSYM = 0x01000000
+_CURRENT_SCREEN = -1
+
+_ErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+
+
+@_ErrorHandler
+def _ignore_error(display, event):
+    # the default handler exits the process
+    return 0
+
+
+class UnsupportedInput(Exception):
+    """Keys or text the driver can't send, to be sent with xdotool instead."""
+
+
+class XInputDriver:
+    """
+    Sends input to the X display `display` (or $DISPLAY). Raises OSError when
+    libX11 or libXtst is missing, or the display can't be opened or lacks XTest.
+    """
+
+    def __init__(self, display: str | None = None):
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="xinput")
+        try:
+            self._executor.submit(self._connect, display).result()
+        except BaseException:
+            self._executor.shutdown(wait=False)
+            raise
+
+    def _connect(self, display: str | None):
+        self._x11 = _load("X11")
+        self._xtst = _load("Xtst")
+        _declare(self._x11, self._xtst)
+        self._display = self._x11.XOpenDisplay(display.encode() if display else None)
+        if not self._display:
+            raise OSError(f"Can't open X display {display or '$DISPLAY'}")
+        self._x11.XSetErrorHandler(_ignore_error)
+        if not self._xtst.XTestQueryExtension(
+            self._display, *(ctypes.byref(ctypes.c_int()) for _ in range(4))
+        ):
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+            raise OSError("The X server has no XTest extension")
+        self._root = self._x11.XDefaultRootWindow(self._display)
+        self._shift = self._keycode(self._keysym("Shift_L"))
+
+    async def _request(self, function: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(self._synced, function, *args)
+        )
+
+    def _synced(self, function: Callable[..., T], *args) -> T:
+        if not self._display:
+            raise OSError("The X display is closed")
+        try:
+            return function(*args)
+        finally:
+            # the acknowledgement: the server has processed every event sent
+            self._x11.XSync(self._display, False)
+
+    async def move(self, x: int, y: int):
+        await self._request(self._move, x, y)
+
+    async def click(self, button: int, repeat: int = 1, delay: float = 0.0):
+        """Click `button` `repeat` times, `delay` seconds apart."""
+        for i in range(repeat):
+            if i:
+                await asyncio.sleep(delay)
+            await self._request(self._click, button)
+
+    async def drag(self, x: int, y: int, button: int = 1):
+        """Press `button`, move to `x`, `y`, and release it."""
+        await self._request(self._drag, x, y, button)
+
+    async def key(self, keys: str):
+        """
+        Press key chords in xdotool syntax, e.g. `ctrl+shift+t Return`, adding
+        shift for keysyms on the shift level (like `A` or `exclam`). Raises
+        UnsupportedInput, before pressing anything, for unknown or unmapped keys
+        and for keysyms that need other modifiers.
+        """
+        await self._request(self._press_keys, keys)
+
+    async def type(self, text: str, delay: float = 0.0):
+        """
+        Type `text`, `delay` seconds per character. Raises UnsupportedInput,
+        before typing anything, for characters the keyboard map lacks.
+        """
+        await self._request(self._type, text, delay)
+
+    async def cursor_position(self) -> tuple[int, int]:
+        return await self._request(self._cursor_position)
+
+    def close(self):
+        if self._display:
+            self._executor.submit(self._disconnect).result()
+        self._executor.shutdown()
+
+    def __del__(self):
+        # every sampling loop has its own ComputerTool, and so its own driver
+        if getattr(self, "_display", None):
+            self._executor.submit(self._disconnect)
+            self._executor.shutdown(wait=False)
+
+    def _disconnect(self):
+        self._x11.XCloseDisplay(self._display)
+        self._display = None
+
+    def _keysym(self, name: str) -> int:
+        name = KEY_ALIASES.get(name.lower(), name)
+        keysym = self._x11.XStringToKeysym(name.encode())
+        if keysym == _NO_SYMBOL:
+            raise UnsupportedInput(f"Unknown key {name!r}")
+        return keysym
+
+    def _keycode(self, keysym: int) -> int:
+        keycode = self._x11.XKeysymToKeycode(self._display, keysym)
+        if not keycode:
+            raise UnsupportedInput(f"No key for keysym {keysym:#x}")
+        return keycode
+
+    def _stroke(self, char: str) -> tuple[int, bool]:
+        """The keycode of `char`, and whether it is typed with shift."""
+        if char in CHARACTER_KEYSYMS:
+            keysym = CHARACTER_KEYSYMS[char]
+        elif 0x20 <= ord(char) < 0x7F or 0xA0 <= ord(char) <= 0xFF:
+            keysym = ord(char)
+        elif ord(char) >= 0x100:
+            keysym = _UNICODE_KEYSYM | ord(char)
+        else:
+            raise UnsupportedInput(f"Can't type {char!r}")
+        return self._shift_level(keysym)
+
+    def _shift_level(self, keysym: int) -> tuple[int, bool]:
+        """The keycode of `keysym`, and whether it is pressed with shift."""
+        keycode = self._keycode(keysym)
+        for level in (0, 1):
+            if self._x11.XkbKeycodeToKeysym(self._display, keycode, 0, level) == keysym:
+                return keycode, level == 1
+        raise UnsupportedInput(f"Can't press keysym {keysym:#x} with shift alone")
+
+    def _move(self, x: int, y: int):
+        self._xtst.XTestFakeMotionEvent(self._display, _CURRENT_SCREEN, x, y, 0)
+
+    def _click(self, button: int):
+        self._xtst.XTestFakeButtonEvent(self._display, button, True, 0)
+        self._xtst.XTestFakeButtonEvent(self._display, button, False, 0)
+
+    def _drag(self, x: int, y: int, button: int):
+        self._xtst.XTestFakeButtonEvent(self._display, button, True, 0)
+        try:
+            self._move(x, y)
+        finally:
+            self._xtst.XTestFakeButtonEvent(self._display, button, False, 0)
+
+    def _press_keys(self, keys: str):
+        chords = [self._chord(chord) for chord in keys.split()]
+        for chord in chords:
+            pressed = []
+            try:
+                for keycode in chord:
+                    self._xtst.XTestFakeKeyEvent(self._display, keycode, True, 0)
+                    pressed.append(keycode)
+            finally:
+                for keycode in reversed(pressed):
+                    self._xtst.XTestFakeKeyEvent(self._display, keycode, False, 0)
+
+    def _chord(self, chord: str) -> list[int]:
+        """The keycodes to press for `chord`, with shift for shifted keysyms."""
+        keycodes: list[int] = []
+        for name in chord.split("+"):
+            keycode, shift = self._shift_level(self._keysym(name))
+            if shift and self._shift not in keycodes:
+                keycodes.append(self._shift)
+            keycodes.append(keycode)
+        return keycodes
+
+    def _type(self, text: str, delay: float):
+        strokes = [self._stroke(char) for char in text]
+        for i, (keycode, shift) in enumerate(strokes):
+            if i and delay:
+                # events must reach the application before the pause
+                self._x11.XSync(self._display, False)
+                time.sleep(delay)
+            if shift:
+                self._xtst.XTestFakeKeyEvent(self._display, self._shift, True, 0)
+            self._xtst.XTestFakeKeyEvent(self._display, keycode, True, 0)
+            self._xtst.XTestFakeKeyEvent(self._display, keycode, False, 0)
+            if shift:
+                self._xtst.XTestFakeKeyEvent(self._display, self._shift, False, 0)
+
+    def _cursor_position(self) -> tuple[int, int]:
+        window = ctypes.c_ulong()
+        x, y, unused = ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+        mask = ctypes.c_uint()
+        self._x11.XQueryPointer(
+            self._display,
+            self._root,
+            ctypes.byref(window),
+            ctypes.byref(window),
+            ctypes.byref(x),
+            ctypes.byref(y),
+            ctypes.byref(unused),
+            ctypes.byref(unused),
+            ctypes.byref(mask),
+        )
+        return x.value, y.value
+
+
+def _load(name: str) -> ctypes.CDLL:
+    if (path := ctypes.util.find_library(name)) is None:
+        raise OSError(f"lib{name} is not installed")
+    return ctypes.CDLL(path)
+
+
+def _declare(x11: ctypes.CDLL, xtst: ctypes.CDLL):
+    display, window, keysym = ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong
+    pointer = ctypes.c_void_p
+    for library, function, restype, argtypes in (
+        (x11, "XOpenDisplay", display, [ctypes.c_char_p]),
+        (x11, "XCloseDisplay", ctypes.c_int, [display]),
+        (x11, "XSetErrorHandler", pointer, [_ErrorHandler]),
+        (x11, "XDefaultRootWindow", window, [display]),
+        (x11, "XSync", ctypes.c_int, [display, ctypes.c_int]),
+        (x11, "XStringToKeysym", keysym, [ctypes.c_char_p]),
+        (x11, "XKeysymToKeycode", ctypes.c_ubyte, [display, keysym]),
+        (
+            x11,
+            "XkbKeycodeToKeysym",
+            keysym,
+            [display, ctypes.c_uint, ctypes.c_int, ctypes.c_int],
+        ),
+        (x11, "XQueryPointer", ctypes.c_int, [display, window] + [pointer] * 7),
+        (xtst, "XTestQueryExtension", ctypes.c_int, [display] + [pointer] * 4),
+        (
+            xtst,
+            "XTestFakeMotionEvent",
+            ctypes.c_int,
+            [display, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_ulong],
+        ),
+        (
+            xtst,
+            "XTestFakeButtonEvent",
+            ctypes.c_int,
+            [display, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong],
+        ),
+        (
+            xtst,
+            "XTestFakeKeyEvent",
+            ctypes.c_int,
+            [display, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong],
+        ),
+    ):
+        getattr(library, function).restype = restype
+        getattr(library, function).argtypes = argtypes
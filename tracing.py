@@ -0,0 +1,332 @@
+"""
+Structured tracing of the sampling loop: nested, timed spans with attributes.
+
+Tracing is off until an exporter is configured:
+
+    tracing.configure(tracing.JsonlExporter("trace.jsonl"))
+
+or from the environment with `configure_from_env` (TRACE_FILE for a JSONL file,
+OTEL_EXPORTER_OTLP_ENDPOINT for an OpenTelemetry collector). While it is off,
+`span` returns a shared no-op span and `traced_callback` returns the callback
+itself, so instrumented code pays next to nothing.
+"""
+
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections.abc import Callable
+from contextvars import ContextVar, Token
+from typing import IO, Any, TypeVar
+
+import httpx
+
+# spans sent to an OTLP collector per request
+OTLP_BATCH_SIZE = 64
+OTLP_FLUSH_INTERVAL = 2.0  # seconds
+# attribute values longer than this are cut, commands and text can be huge
+MAX_ATTRIBUTE_LENGTH = 256
+
+AttributeValue = str | int | float | bool
+
+
+class Span:
+    """A timed operation; ended (and exported) when its `with` block exits."""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "status",
+        "_token",
+    )
+
+    def __init__(self, name: str, parent: "Span | None", attributes: dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = 0
+        self.end_ns = 0
+        self.attributes: dict[str, AttributeValue] = {}
+        self.status = "ok"
+        self._token: Token | None = None
+        self.set_attributes(**attributes)
+
+    def set_attribute(self, key: str, value: Any):
+        if value is None:
+            return
+        if not isinstance(value, AttributeValue):
+            value = str(value)
+        if isinstance(value, str) and len(value) > MAX_ATTRIBUTE_LENGTH:
+            value = value[:MAX_ATTRIBUTE_LENGTH] + "..."
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.status = "error"
+            self.set_attribute("error", f"{exc_type.__name__}: {exc}")
+        if self._token is not None:
+            _current_span.reset(self._token)
+        if _exporter is not None:
+            _exporter.export(self)
+
+    # usable in `async with` statements alongside other context managers
+    async def __aenter__(self) -> "Span":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.__exit__(exc_type, exc, traceback)
+
+
+class _NoopSpan:
+    """Stands in for every span while tracing is off."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes: Any):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+    async def __aenter__(self) -> "_NoopSpan":
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter(metaclass=ABCMeta):
+    """Receives every span as it ends."""
+
+    @abstractmethod
+    def export(self, span: Span):
+        """Called on the thread the span ended on; should not block for long."""
+        ...
+
+    def shutdown(self):
+        """Flush and release resources, called by `configure` and at exit."""
+
+
+class JsonlExporter(SpanExporter):
+    """Appends one JSON object per span to a file."""
+
+    def __init__(self, path: str | os.PathLike[str]):
+        self._file: IO[str] = open(path, "a", buffering=1)
+
+    def export(self, span: Span):
+        self._file.write(
+            json.dumps(
+                {
+                    "name": span.name,
+                    "trace_id": span.trace_id,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "start_ns": span.start_ns,
+                    "end_ns": span.end_ns,
+                    "duration_ms": span.duration_ms,
+                    "status": span.status,
+                    "attributes": span.attributes,
+                }
+            )
+            + "\n"
+        )
+
+    def shutdown(self):
+        self._file.close()
+
+
+class OtlpHttpExporter(SpanExporter):
+    """
+    Sends spans to an OpenTelemetry collector with OTLP/HTTP and JSON encoding.
+    Spans are batched and posted from a background thread, never from the event
+    loop.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = "http://localhost:4318/v1/traces",
+        *,
+        service_name: str = "computer-use-demo",
+        headers: dict[str, str] | None = None,
+    ):
+        self.endpoint = endpoint
+        self._resource = {"attributes": [_otlp_attribute("service.name", service_name)]}
+        self._headers = headers or {}
+        self._queue: queue.Queue[Span | None] = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="otlp-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, span: Span):
+        self._queue.put(span)
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        with httpx.Client(headers=self._headers, timeout=10) as client:
+            stopped = False
+            while not stopped:
+                batch: list[Span] = []
+                deadline = time.monotonic() + OTLP_FLUSH_INTERVAL
+                while len(batch) < OTLP_BATCH_SIZE:
+                    try:
+                        span = self._queue.get(
+                            timeout=max(0.0, deadline - time.monotonic())
+                        )
+                    except queue.Empty:
+                        break
+                    if span is None:
+                        stopped = True
+                        break
+                    batch.append(span)
+                if batch:
+                    self._post(client, batch)
+
+    def _post(self, client: httpx.Client, batch: list[Span]):
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": self._resource,
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [_otlp_span(span) for span in batch],
+                        }
+                    ],
+                }
+            ]
+        }
+        try:
+            client.post(self.endpoint, json=body).raise_for_status()
+        except httpx.HTTPError:
+            # losing a batch of spans must never disturb the session
+            pass
+
+
+def _otlp_span(span: Span) -> dict[str, Any]:
+    otlp = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [
+            _otlp_attribute(key, value) for key, value in span.attributes.items()
+        ],
+        # STATUS_CODE_OK, STATUS_CODE_ERROR
+        "status": {"code": 2 if span.status == "error" else 1},
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+def _otlp_attribute(key: str, value: AttributeValue) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": value}}
+
+
+_exporter: SpanExporter | None = None
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def configure(exporter: SpanExporter | None):
+    """Send spans to `exporter`, or turn tracing off with None."""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    if previous is not None:
+        previous.shutdown()
+
+
+def configure_from_env() -> SpanExporter | None:
+    """
+    Configure an exporter from TRACE_FILE or OTEL_EXPORTER_OTLP_ENDPOINT, unless
+    one is already set. Returns the exporter in use.
+    """
+    if _exporter is not None:
+        return _exporter
+    if trace_file := os.getenv("TRACE_FILE"):
+        configure(JsonlExporter(trace_file))
+    elif otlp_endpoint := os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        configure(OtlpHttpExporter(otlp_endpoint.rstrip("/") + "/v1/traces"))
+    return _exporter
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def span(name: str, **attributes: Any) -> Span | _NoopSpan:
+    """
+    A span for a `with` block, nested under the span the block runs in.
+    Attributes set to None are left out.
+    """
+    if _exporter is None:
+        return NOOP_SPAN
+    return Span(name, _current_span.get(), attributes)
+
+
+def current_span() -> Span | _NoopSpan:
+    return _current_span.get() or NOOP_SPAN
+
+
+Callback = TypeVar("Callback", bound=Callable[..., Any])
+
+
+def traced_callback(name: str, callback: Callback) -> Callback:
+    """Wrap `callback` in a span per call; returns it unchanged while tracing is off."""
+    if _exporter is None:
+        return callback
+
+    def traced(*args, **kwargs):
+        with span(name):
+            return callback(*args, **kwargs)
+
+    return traced  # type: ignore[return-value]
+
+
+@atexit.register
+def _shutdown():
+    configure(None)